@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Benchmark draining a large batch of events one at a time via read_event()
+
+This is what 'for event in inotify' does when a single read returns a large
+batch of events (eg during a git checkout)
+
+Usage: python benchmarks/eventlike_drain.py [events per batch] [rounds]
+"""
+
+from butter.utils import Eventlike
+from time import perf_counter
+import sys
+
+
+class FakeEventlike(Eventlike):
+    """Returns the same pre built batch of events on every read"""
+    def __init__(self, batch):
+        super(FakeEventlike, self).__init__()
+        self._batch = batch
+
+    def _read_events(self):
+        return list(self._batch)
+
+
+class LegacyEventlike(FakeEventlike):
+    """The list based queue as shipped in butter <= 0.12.2"""
+    def __init__(self, batch):
+        super(LegacyEventlike, self).__init__(batch)
+        self._events = []
+
+    def read_event(self):
+        try:
+            event = self._events.pop(0)
+        except IndexError:
+            events = self._read_events()
+            event = events.pop(0)
+            self._events = events
+
+        return event
+
+
+def bench(cls, count, rounds):
+    batch = list(range(count))
+    best = None
+    for i in range(rounds):
+        obj = cls(batch)
+        start = perf_counter()
+        for j in range(count):
+            obj.read_event()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return count / best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    before = bench(LegacyEventlike, count, rounds)
+    after = bench(FakeEventlike, count, rounds)
+
+    print("events per batch: {}".format(count))
+    print("list.pop(0):      {:>12,.0f} events/sec".format(before))
+    print("deque.popleft():  {:>12,.0f} events/sec".format(after))
+    print("speedup:          {:>12.2f}x".format(after / before))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Benchmark eager vs lazy filename decoding when events are filtered on
+their mask alone
+
+Usage: python benchmarks/inotify_lazy.py [events per buffer] [rounds]
+"""
+
+from butter._inotify import str_to_events, str_to_lazy_events
+from butter._inotify import IN_MODIFY, IN_CLOSE_WRITE, IN_OPEN, IN_ACCESS
+from time import perf_counter
+import tracemalloc
+import struct
+import sys
+
+MASKS = [IN_OPEN, IN_ACCESS, IN_MODIFY, IN_CLOSE_WRITE]
+
+
+def make_buffer(count):
+    """Build a buffer in the same format the kernel returns, every event is
+    against a named file as is the case for a watched directory"""
+    buf = bytearray()
+    for i in range(count):
+        name = 'file_{}.txt'.format(i).encode()
+        # the kernel pads names with NULLs to a multiple of the struct size
+        name_len = (len(name) + 16) & ~15
+        buf += struct.pack('iIII', 1, MASKS[i % len(MASKS)], 0, name_len)
+        buf += name.ljust(name_len, b'\0')
+
+    return bytes(buf)
+
+
+def consume(parse, buf):
+    """Parse a read and keep only the IN_CLOSE_WRITE events, which is
+    decided on the mask alone, then use their filenames"""
+    events = [event for event in parse(buf) if event.mask & IN_CLOSE_WRITE]
+    return [event.filename for event in events]
+
+
+def allocations(parse, buf):
+    """Number of allocations and bytes made while parsing (events kept alive)"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    events = parse(buf)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    count = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    del events
+
+    return count, size
+
+
+def bench(func, buf, rounds):
+    best = None
+    for i in range(rounds):
+        start = perf_counter()
+        consume(func, buf)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    buf = make_buffer(count)
+    assert str_to_events(buf) == str_to_lazy_events(buf), "parsers disagree"
+    assert consume(str_to_events, buf) == consume(str_to_lazy_events, buf), "parsers disagree"
+
+    eager_allocs, eager_bytes = allocations(str_to_events, buf)
+    lazy_allocs, lazy_bytes = allocations(str_to_lazy_events, buf)
+    eager_time = bench(str_to_events, buf, rounds)
+    lazy_time = bench(str_to_lazy_events, buf, rounds)
+
+    print("events per buffer: {} ({} bytes), 1 in {} kept".format(count, len(buf), len(MASKS)))
+    print("                   {:>14} {:>14} {:>14}".format("allocs/event", "bytes/event", "events/sec"))
+    print("eager:             {:>14.2f} {:>14.1f} {:>14,.0f}".format(
+        eager_allocs / count, eager_bytes / count, count / eager_time))
+    print("lazy:              {:>14.2f} {:>14.1f} {:>14,.0f}".format(
+        lazy_allocs / count, lazy_bytes / count, count / lazy_time))
+
+
+if __name__ == "__main__":
+    main()
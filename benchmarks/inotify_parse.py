@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Benchmark the inotify event parser against the original copying implementation
+
+Usage: python benchmarks/inotify_parse.py [events per buffer] [rounds]
+"""
+
+from butter._inotify import str_to_events, InotifyEvent, IN_MODIFY, ffi
+from time import perf_counter
+import struct
+import sys
+
+
+def legacy_str_to_events(str):
+    """The parser as shipped in butter <= 0.12.2, copies the buffer into cdata
+    and then slices (copies again) for every event before casting it"""
+    event_struct_size = ffi.sizeof('struct inotify_event')
+
+    events = []
+
+    str_buf = ffi.new('char[]', len(str))
+    str_buf[0:len(str)] = str
+
+    i = 0
+    while i < len(str_buf):
+        event = ffi.cast('struct inotify_event *', str_buf[i:i+event_struct_size])
+
+        filename_start = i + event_struct_size
+        filename_end = filename_start + event.len
+        filename = ffi.string(str_buf[filename_start:filename_end])
+
+        events.append(InotifyEvent(event.wd, event.mask, event.cookie, filename))
+
+        i += event_struct_size + event.len
+
+    return events
+
+
+def make_buffer(count):
+    """Build a buffer in the same format the kernel returns with a mix of
+    named and unnamed events"""
+    buf = bytearray()
+    for i in range(count):
+        name = 'file_{}.txt'.format(i).encode() if i % 4 else b''
+        # the kernel pads names with NULLs to a multiple of the struct size
+        name_len = (len(name) + 16) & ~15 if name else 0
+        buf += struct.pack('iIII', 1, IN_MODIFY, 0, name_len)
+        buf += name.ljust(name_len, b'\0')
+
+    return bytes(buf)
+
+
+def bench(func, buf, count, rounds):
+    best = None
+    for i in range(rounds):
+        start = perf_counter()
+        func(buf)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return count / best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    buf = make_buffer(count)
+    assert legacy_str_to_events(buf) == str_to_events(buf), "parsers disagree"
+
+    before = bench(legacy_str_to_events, buf, count, rounds)
+    after = bench(str_to_events, buf, count, rounds)
+
+    print("events per buffer: {} ({} bytes)".format(count, len(buf)))
+    print("legacy parser:     {:>12,.0f} events/sec".format(before))
+    print("in place parser:   {:>12,.0f} events/sec".format(after))
+    print("speedup:           {:>12.2f}x".format(after / before))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,4 +7,4 @@ __email__ = "code@pocketnix.org"
 __license__ = "BSD (3 Clause)"
 __url__ = "http://code.pocketnix.org/butter"
 
-__all__ = ['fanotify', 'inotify', 'seccomp', 'splice', 'system', 'utils']
+__all__ = ['dirstate', 'fanotify', 'inotify', 'poller', 'seccomp', 'splice', 'system', 'utils']
@@ -2,6 +2,7 @@
 """eventfd: maintain an atomic counter inside a file descriptor"""
 from .utils import UnknownError, CLOEXEC_DEFAULT
 from cffi import FFI
+import struct
 import errno
 
 from ._eventfd_c import ffi
@@ -66,12 +67,14 @@ def eventfd(inital_value=0, flags=0, closefd=CLOEXEC_DEFAULT):
 
     return fd
 
+_counter = struct.Struct('Q')
+
 def str_to_events(str):
-    value = ffi.new('uint64_t[1]')
-    ffi.buffer(value, 8)[0:8] = str
+    # unpack_from works on any buffer (eg the reusable read buffer) without
+    # needing to copy the value into cdata first
+    value, = _counter.unpack_from(str)
 
-    return [value[0]] # this may seem redundent but the original
-                      # container is not actually a list
+    return [value]
 
 def event_to_str(event):
     # We use ffi rather than the array module as
@@ -2,14 +2,18 @@
 """fanotify: wrapper around the fanotify family of syscalls for watching for file modifcation"""
 
 from .utils import PermissionError, UnknownError, CLOEXEC_DEFAULT
+from .fhandle import FileHandle
 from collections import namedtuple
 from os import O_RDONLY, O_WRONLY, O_RDWR
-from os import getpid, readlink
-from os import close
+from os import getpid, readlink, fsdecode, strerror
+from os import close, writev
 from os.path import join
+import struct
 import errno
 
 READ_EVENTS_MAX = 10
+# Maximum number of iovecs the kernel accepts in one writev()
+IOV_MAX = 1024
 
 from ._fanotify_c import ffi, lib
 
@@ -81,21 +85,112 @@ def fanotify_mark(fd, path, mask, flags, dfd=0):
             # If you are here, its a bug. send us the traceback
             raise UnknownError(err)
 
+def fanotify_fsid(fd):
+    """Return the fsid of the filesystem fd is on, as carried by events in
+    the fd-less modes (see FanotifyFidEvent)
+
+    Arguments
+    ----------
+    :param int fd: An fd (opened with O_PATH is enough) of any file on the filesystem
+
+    Returns
+    --------
+    :return: The fsid
+    :rtype: tuple of 2 ints
+    """
+    if hasattr(fd, 'fileno'):
+        fd = fd.fileno()
+
+    assert isinstance(fd, int), 'FD must be an integer'
+
+    fsid = ffi.new('int32_t[2]')
+    if lib.fanotify_fsid(fd, fsid) < 0:
+        err = ffi.errno
+        raise OSError(err, strerror(err))
+
+    return (fsid[0], fsid[1])
+
+# struct fanotify_response, the kernel only takes one per write() so a
+# batch is written as one iovec per response
+_response = struct.Struct('iI')
+assert _response.size == ffi.sizeof('struct fanotify_response'), "struct fanotify_response layout mismatch"
+
+def fanotify_respond(fd, responses):
+    """Answer a batch of permission events (FAN_OPEN_PERM/FAN_ACCESS_PERM)
+
+    The responses are written with a single writev() per IOV_MAX
+    responses. A response the kernel rejects because the event has
+    already been answered is skipped and the rest are still written
+
+    Arguments
+    ----------
+    :param int fd: The fanotify fd the events were read from
+    :param list responses: (event fd, FAN_ALLOW or FAN_DENY) pairs
+
+    Returns
+    --------
+    :return: The number of responses accepted
+    :rtype: int
+
+    Exceptions
+    -----------
+    :raises ValueError: fd is not a fanotify fd or a response is not FAN_ALLOW/FAN_DENY
+    """
+    if hasattr(fd, 'fileno'):
+        fd = fd.fileno()
+
+    assert isinstance(fd, int), 'FD must be an integer'
+
+    pack = _response.pack
+    iovecs = [pack(event_fd, response) for event_fd, response in responses]
+    size = _response.size
+
+    accepted = 0
+    i = 0
+    while i < len(iovecs):
+        chunk = iovecs[i:i + IOV_MAX]
+        try:
+            done = writev(fd, chunk) // size
+        except OSError as err:
+            # the first response in the chunk was rejected
+            if err.errno == errno.ENOENT:
+                # no such event pending, already answered
+                i += 1
+                continue
+            elif err.errno == errno.EBADF:
+                raise ValueError("fd does not exist or was of the incorrect type")
+            elif err.errno == errno.EINVAL:
+                raise ValueError("Invalid response or fd is not a fanotify fd")
+            else:
+                # If you are here, its a bug. send us the traceback
+                raise UnknownError(err.errno)
+
+        # the kernel stops at the first response it rejects, the next
+        # writev() starts with it and reports why
+        accepted += done
+        i += done
+
+    return accepted
+
 class FanotifyEvent(object):
-    __slots__ = ['_filename', 'version', 'mask', 'fd', 'pid']
-    def __init__(self, version, mask, fd, pid):
+    __slots__ = ['_filename', '_resolver', 'version', 'mask', 'fd', 'pid']
+    def __init__(self, version, mask, fd, pid, resolver=None):
         self.version = version
         self.mask = mask
         self.fd = fd
         self.pid = pid
 
         self._filename = None
+        self._resolver = resolver
                 
     @property
     def filename(self):
         if not self._filename:
             try:
-                name = readlink(join('/proc', 'self', 'fd', str(self.fd)))
+                if self._resolver is not None:
+                    name = self._resolver(self.fd)
+                else:
+                    name = readlink(join('/proc', 'self', 'fd', str(self.fd)))
                 self._filename = name
             except OSError:
                 self._filename = "<Unknown>"
@@ -155,19 +250,115 @@ class FanotifyEvent(object):
         return True if self.mask & FAN_EVENT_ON_CHILD else False
 
 
-def str_to_events(str):
-    event_struct_size = ffi.sizeof('struct fanotify_event_metadata')
+class FanotifyFidEvent(FanotifyEvent):
+    """An event read in one of the fd-less modes (FAN_REPORT_FID,
+    FAN_REPORT_DIR_FID, FAN_REPORT_DFID_NAME), rather than an open fd the
+    file is identified by the fsid of its filesystem and a FileHandle of
+    the file itself (handle) and/or its directory (dir_handle) and name.
+    fd is always FAN_NOFD and filename is resolved from the handles on
+    first use (see HandleResolver)
+    """
+    __slots__ = ['fsid', 'handle', 'dir_handle', 'name']
+    def __init__(self, version, mask, fd, pid, fsid, handle, dir_handle, name, resolver=None):
+        super(FanotifyFidEvent, self).__init__(version, mask, fd, pid, resolver)
+        self.fsid = fsid
+        self.handle = handle
+        self.dir_handle = dir_handle
+        self.name = name
+
+    @property
+    def filename(self):
+        if not self._filename:
+            try:
+                if self._resolver is None:
+                    raise OSError(errno.ENODEV, "No resolver for file handles")
+                if self.dir_handle is not None:
+                    self._filename = self._resolver(self.fsid, self.dir_handle, self.name)
+                else:
+                    self._filename = self._resolver(self.fsid, self.handle)
+            except OSError:
+                self._filename = "<Unknown>"
+
+        return self._filename
+
+    def close(self):
+        # there is no fd to close
+        pass
+
+    def __repr__(self):
+        return "<FanotifyFidEvent fsid={}, handle={}, dir_handle={}, name={}, mask=0x{:X}, pid={}>".format(
+                self.fsid, self.handle, self.dir_handle, self.name, self.mask, self.pid)
 
-    events = []
 
-    str_buf = ffi.new('char[]', len(str))
-    str_buf[0:len(str)] = str
+# struct fanotify_event_metadata, unpacked straight out of the read buffer
+_event_metadata = struct.Struct('IBBHQii')
+assert _event_metadata.size == ffi.sizeof('struct fanotify_event_metadata'), "struct fanotify_event_metadata layout mismatch"
+# struct fanotify_event_info_fid (header and fsid) followed by the struct file_handle header
+_info_fid = struct.Struct('BBHii')
+assert _info_fid.size == ffi.sizeof('struct fanotify_event_info_fid'), "struct fanotify_event_info_fid layout mismatch"
+_file_handle = struct.Struct('Ii')
+
+_FID_RECORDS = (lib.FAN_EVENT_INFO_TYPE_FID, lib.FAN_EVENT_INFO_TYPE_DFID, lib.FAN_EVENT_INFO_TYPE_DFID_NAME)
+
+def _parse_fid_info(str, i, end):
+    """Parse the info records between i and end (the rest of an event),
+    returns (fsid, handle, dir_handle, name), records of other types are skipped"""
+    fsid = handle = dir_handle = name = None
+    while i < end:
+        info_type, _, info_len, fsid_0, fsid_1 = _info_fid.unpack_from(str, i)
+        if info_len == 0:
+            # malformed, would never advance
+            break
+
+        if info_type in _FID_RECORDS:
+            fsid = (fsid_0, fsid_1)
+            handle_start = i + _info_fid.size
+            handle_bytes, handle_type = _file_handle.unpack_from(str, handle_start)
+            handle_start += _file_handle.size
+            file_handle = FileHandle(handle_type, bytes(str[handle_start:handle_start + handle_bytes]))
+
+            if info_type == lib.FAN_EVENT_INFO_TYPE_FID:
+                handle = file_handle
+            else:
+                dir_handle = file_handle
+                if info_type == lib.FAN_EVENT_INFO_TYPE_DFID_NAME:
+                    # NUL terminated and padded to the record length
+                    raw = bytes(str[handle_start + handle_bytes:i + info_len])
+                    name = fsdecode(raw.split(b'\0', 1)[0])
+
+        i += info_len
+
+    return fsid, handle, dir_handle, name
+
+def str_to_events(str, length=None, resolver=None):
+    """Parse the buffer returned by read()ing a fanotify fd into a list of FanotifyEvents
+
+    Arguments
+    ----------
+    :param bytes str: The raw bytes (or any object supporting the buffer protocol) read from the fd
+    :param int length: Only parse the first length bytes of the buffer (default: all of it)
+    :param callable resolver: Called with the event fd to look up the filename (default: readlink the fd in /proc),
+                              for events with file handles called as resolver(fsid, handle[, name])
+
+    Returns
+    --------
+    :return: The events contained in the buffer, FanotifyFidEvents for events carrying info records
+    :rtype: list of FanotifyEvent
+    """
+    unpack_metadata = _event_metadata.unpack_from
+    buf_len = len(str) if length is None else length
+
+    events = []
 
     i = 0
-    while i < len(str_buf):
-        event = ffi.cast('struct fanotify_event_metadata *', str_buf[i:i+event_struct_size])
-        events.append(FanotifyEvent(event.vers, event.mask, event.fd, event.pid))
+    while i < buf_len:
+        event_len, vers, _, metadata_len, mask, fd, pid = unpack_metadata(str, i)
+        if metadata_len < event_len:
+            fsid, handle, dir_handle, name = _parse_fid_info(str, i + metadata_len, i + event_len)
+            events.append(FanotifyFidEvent(vers, mask, fd, pid, fsid, handle, dir_handle, name, resolver))
+        else:
+            events.append(FanotifyEvent(vers, mask, fd, pid, resolver))
 
-        i += event.event_len
+        i += event_len
 
     return events
@@ -2,7 +2,10 @@
 """inotify: Wrapper around the inotify syscalls providing both a function based and file like interface"""
 
 from collections import namedtuple
+from itertools import compress
+from array import array
 from .utils import PermissionError, UnknownError, CLOEXEC_DEFAULT
+import struct
 import errno
 
 from ._inotify_c import ffi, lib
@@ -81,6 +84,7 @@ def inotify_add_watch(fd, path, mask):
     ValueError:
     * No valid events in the event mask
     * fd is not an inotify file descriptor
+    * IN_ONLYDIR was specified and path is not a directory
     OSError:
     * fd is not a valid file descriptor
     * Process has no access to specified file
@@ -114,8 +118,10 @@ def inotify_add_watch(fd, path, mask):
             raise ValueError("path points to a file/folder outside the processes accessible address space")
         elif err == errno.ENOENT:
             raise ValueError("File/Folder pointed to by path does not exist")
+        elif err == errno.ENOTDIR:
+            raise ValueError("IN_ONLYDIR was specified and path is not a directory")
         elif err == errno.ENOSPC:
-            raise OSError("Maximum number of watches hit or insufficent kernel resources")
+            raise OSError(errno.ENOSPC, "Maximum number of watches hit or insufficent kernel resources")
         elif err == errno.ENOMEM:
             raise MemoryError("Insufficent kernel memory avalible")
         else:
@@ -160,32 +166,230 @@ def inotify_rm_watch(fd, wd):
             raise UnknownError(err)
 
 
-def str_to_events(str):
-    event_struct_size = ffi.sizeof('struct inotify_event')
+# struct inotify_event without the trailing name, unpacked straight out of the
+# read buffer so parsing does not need to copy the buffer into cdata first
+_event_header = struct.Struct('iIII')
+assert _event_header.size == ffi.sizeof('struct inotify_event'), "struct inotify_event layout mismatch"
+
+# Largest single event the kernel can return (header + NAME_MAX + NULL), a read
+# with a smaller buffer than this may fail with EINVAL
+EVENT_SIZE_MAX = _event_header.size + 255 + 1
+
+def str_to_events(str, length=None, event_filter=None):
+    """Parse the buffer returned by read()ing an inotify fd into a list of InotifyEvents
+
+    The buffer is walked in place, only the filenames are copied out of it
+
+    Arguments
+    ----------
+    :param bytes str: The raw bytes (or any object supporting the buffer protocol) read from the fd
+    :param int length: Only parse the first length bytes of the buffer (default: all of it)
+    :param callable event_filter: Called as event_filter(wd, mask, filename) for every event,
+                                  events it returns False for are skipped before an InotifyEvent is built
+
+    Returns
+    --------
+    :return: The events contained in the buffer
+    :rtype: list of InotifyEvent
+    """
+    event_struct_size = _event_header.size
+    unpack_header = _event_header.unpack_from
+    string = ffi.string
+
+    buf = ffi.from_buffer(str)
+    buf_len = len(buf) if length is None else length
 
     events = []
+    append = events.append
+
+    i = 0
+    while i < buf_len:
+        wd, mask, cookie, filename_len = unpack_header(str, i)
+        i += event_struct_size
+
+        if filename_len:
+            # name is NULL padded to an alignment boundary, ffi.string stops at the first NULL
+            filename = string(buf + i, filename_len)
+        else:
+            filename = b''
+
+        i += filename_len
+
+        if event_filter is not None and not event_filter(wd, mask, filename):
+            continue
+
+        append(InotifyEvent(wd, mask, cookie, filename))
+
+    return events
+
+
+def str_to_batch(str, length=None):
+    """Parse the buffer returned by read()ing an inotify fd into an InotifyBatch
+
+    Arguments
+    ----------
+    :param bytes str: The raw bytes (or any object supporting the buffer protocol) read from the fd
+    :param int length: Only parse the first length bytes of the buffer (default: all of it)
+
+    Returns
+    --------
+    :return: The events contained in the buffer
+    :rtype: InotifyBatch
+    """
+    # the one copy made, holds the filenames for the lifetime of the batch
+    raw = bytes(str[:length]) if length is not None else bytes(str)
+    batch = InotifyBatch(raw)
+
+    event_struct_size = _event_header.size
+    unpack_header = _event_header.unpack_from
+    add_wd = batch.wd.append
+    add_mask = batch.mask.append
+    add_cookie = batch.cookie.append
+    add_name_start = batch._name_start.append
+    add_name_len = batch._name_len.append
+
+    raw_len = len(raw)
+    i = 0
+    while i < raw_len:
+        wd, mask, cookie, filename_len = unpack_header(raw, i)
+        i += event_struct_size
+
+        add_wd(wd)
+        add_mask(mask)
+        add_cookie(cookie)
+        add_name_start(i)
+        add_name_len(filename_len)
+
+        i += filename_len
+
+    return batch
+
+
+def str_to_lazy_events(str, length=None):
+    """Parse the buffer returned by read()ing an inotify fd into a list of
+    LazyInotifyEvents
+
+    The used part of the buffer is copied once and shared by all the events,
+    filenames are only copied out of it when an event's filename is accessed
+
+    Arguments
+    ----------
+    :param bytes str: The raw bytes (or any object supporting the buffer protocol) read from the fd
+    :param int length: Only parse the first length bytes of the buffer (default: all of it)
+
+    Returns
+    --------
+    :return: The events contained in the buffer
+    :rtype: list of LazyInotifyEvent
+    """
+    raw = bytes(str[:length]) if length is not None else bytes(str)
 
-    str_buf = ffi.new('char[]', len(str))
-    str_buf[0:len(str)] = str
+    event_struct_size = _event_header.size
+    unpack_header = _event_header.unpack_from
 
+    events = []
+    append = events.append
+
+    raw_len = len(raw)
     i = 0
-    while i < len(str_buf):
-        event = ffi.cast('struct inotify_event *', str_buf[i:i+event_struct_size])
+    while i < raw_len:
+        wd, mask, cookie, filename_len = unpack_header(raw, i)
+        i += event_struct_size
 
-        filename_start = i + event_struct_size
-        filename_end = filename_start + event.len
-        filename = ffi.string(str_buf[filename_start:filename_end])
-        
-        events.append(InotifyEvent(event.wd, event.mask, event.cookie, filename))
-        
-        i += event_struct_size + event.len
+        append(LazyInotifyEvent(wd, mask, cookie, raw, i if filename_len else -1))
+
+        i += filename_len
 
     return events
 
 
-InotifyEvent = namedtuple("InotifyEvent", "wd mask cookie filename")
-class InotifyEvent(InotifyEvent):
+class InotifyBatch(object):
+    """A batch of inotify events stored as columns rather than as one object
+    per event
+
+    wd, mask and cookie are arrays with one entry per event, the filenames
+    are kept in a single shared buffer and only copied out when asked for.
+    InotifyEvent objects are only created when the batch is indexed or
+    iterated so consumers that filter on the mask alone (see indices) avoid
+    the per event allocations entirely
+
+    >>> batch = inotify.read_batch()
+    >>> for i in batch.indices(IN_CLOSE_WRITE):
+    ...     rebuild(batch.wd[i], batch.filename(i))
+    """
+    __slots__ = ['wd', 'mask', 'cookie', '_names', '_name_start', '_name_len']
+
+    def __init__(self, names=b''):
+        self.wd = array('i')
+        self.mask = array('I')
+        self.cookie = array('I')
+
+        self._names = names
+        self._name_start = array('I')
+        self._name_len = array('I')
+
+    @classmethod
+    def from_events(cls, events):
+        """Build a batch from a list of InotifyEvents"""
+        names = []
+        offset = 0
+        batch = cls()
+        for wd, mask, cookie, filename in events:
+            batch.wd.append(wd)
+            batch.mask.append(mask)
+            batch.cookie.append(cookie)
+            batch._name_start.append(offset)
+            batch._name_len.append(len(filename))
+            names.append(filename)
+            offset += len(filename)
+
+        batch._names = b''.join(names)
+
+        return batch
+
+    def filename(self, i):
+        """Return the filename of the i'th event"""
+        start = self._name_start[i]
+        length = self._name_len[i]
+        if not length:
+            return b''
+
+        # names from the kernel are NULL padded
+        end = self._names.find(b'\0', start, start + length)
+        return self._names[start:end if end >= 0 else start + length]
+
+    def indices(self, mask):
+        """Return the indices of all the events with any of the bits in mask set"""
+        return list(compress(range(len(self.mask)), map(mask.__and__, self.mask)))
+
+    def count(self, mask):
+        """Return the number of events with any of the bits in mask set"""
+        return sum(1 for _ in compress(self.mask, map(mask.__and__, self.mask)))
+
+    def events(self, indices=None):
+        """Return InotifyEvents for the events at indices (default: all of them)"""
+        if indices is None:
+            indices = range(len(self))
+        return [self[i] for i in indices]
+
+    def __len__(self):
+        return len(self.wd)
+
+    def __getitem__(self, i):
+        return InotifyEvent(self.wd[i], self.mask[i], self.cookie[i], self.filename(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "<{} events={}>".format(self.__class__.__name__, len(self))
+
+
+class InotifyEventMask(object):
+    """Mixin providing named tests for the bits set in an event's mask"""
     __slots__ = []
+
     @property
     def access_event(self):
         return True if self.mask & IN_ACCESS else False
@@ -242,6 +446,81 @@ class InotifyEvent(InotifyEvent):
     def is_dir_event(self):
         return True if self.mask & IN_ISDIR else False
 
+
+InotifyEvent = namedtuple("InotifyEvent", "wd mask cookie filename")
+class InotifyEvent(InotifyEventMask, InotifyEvent):
+    __slots__ = []
+
+
+InotifyPathEvent = namedtuple("InotifyPathEvent", "wd mask cookie filename path")
+class InotifyPathEvent(InotifyEventMask, InotifyPathEvent):
+    """An InotifyEvent that also carries the full path the event occurred against"""
+    __slots__ = []
+
+
+class LazyInotifyEvent(InotifyEventMask):
+    """An InotifyEvent that holds a reference to the raw buffer it was read
+    from and only copies its filename out when filename is first accessed
+
+    Consumers that discard most events on the mask alone skip the filename
+    allocation for those events. Compares equal to and unpacks like the
+    equivalent InotifyEvent, note that every event from a read keeps the
+    whole raw buffer alive until its filename has been accessed
+    """
+    # _raw holds the raw buffer while _offset is >= 0 and the filename once
+    # it has been copied out, keeping the object as small as possible
+    __slots__ = ['wd', 'mask', 'cookie', '_raw', '_offset']
+
+    def __init__(self, wd, mask, cookie, raw, offset):
+        """Arguments
+        ----------
+        :param bytes raw: The raw buffer the event was read from
+        :param int offset: Where the event's NULL padded filename starts in raw, -1 if it has none
+        """
+        self.wd = wd
+        self.mask = mask
+        self.cookie = cookie
+        self._raw = raw if offset >= 0 else b''
+        self._offset = offset
+
+    @property
+    def filename(self):
+        start = self._offset
+        if start < 0:
+            return self._raw
+
+        # names from the kernel are always NULL terminated
+        filename = self._raw[start:self._raw.index(b'\0', start)]
+        self._raw = filename
+        self._offset = -1
+        return filename
+
+    def _replace(self, **kwargs):
+        return InotifyEvent(*self)._replace(**kwargs)
+
+    def __iter__(self):
+        return iter((self.wd, self.mask, self.cookie, self.filename))
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, i):
+        return tuple(self)[i]
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return "{}(wd={!r}, mask={!r}, cookie={!r}, filename={!r})".format(
+            self.__class__.__name__, self.wd, self.mask, self.cookie, self.filename)
+
+
 # update the local namespace with flags and provide
 # a handy dict for reversable lookups
 event_name = {}
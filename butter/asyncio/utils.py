@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""Shared machinery for the asyncio wrappers around event queue like fds"""
+
+from collections import deque as _deque
+import asyncio as _asyncio
+
+
+class Eventlike_async:
+    """Read batches of events from an Eventlike object (Inotify, Fanotify)
+    on an asyncio event loop with bounded buffering
+
+    The fd stays registered with the loop from the first call to
+    get_batch()/get_event()/batches() until the object is closed or the
+    queue reaches maxsize events. Once full reading is paused so the
+    kernel queue absorbs the burst rather than this process's memory, and
+    resumed once consumers have drained it down to low_water, much like an
+    asyncio transport's pause_reading()/resume_reading(). Events are never
+    dropped here, if the kernel queue fills up in turn the kernel drops
+    events and queues an overflow event which is counted in overflows
+    """
+    # defaults so the repr works on partially constructed objects
+    _closed = False
+
+    def __init__(self, source, loop=None, maxsize=0, low_water=None):
+        """Arguments
+        ----------
+        :param Eventlike source: The non-blocking object to read events from
+        :param loop: The event loop to use (default: the current event loop)
+        :param int maxsize: High water mark, pause reading once this many events are queued (0 for no limit)
+        :param int low_water: Resume reading once the queue drops to this many events (default: maxsize // 2)
+        """
+        self._loop = loop or _asyncio.get_event_loop()
+        self._maxsize = maxsize
+        self._low_water = maxsize // 2 if low_water is None else low_water
+        self._source = source
+
+        self._batches = _deque()
+        self._queued = 0 # events held in _batches
+        self._head = _deque() # remainder of the batch being consumed by get_event()
+        self._waiters = _deque()
+        self._reading = False
+        self._paused = False
+
+        # number of times reading was paused because the queue was full
+        self.pauses = 0
+
+    async def get_batch(self):
+        """Remove and return the oldest batch of events, waiting for one if
+        the queue is empty
+
+        Returns
+        --------
+        :return: The events from a single read of the fd
+        :rtype: list
+
+        Exceptions
+        -----------
+        :raises EOFError: The object has been closed and all events have been consumed
+        """
+        while not self._head and not self._batches:
+            if self._closed:
+                raise EOFError("{} has been closed".format(self.__class__.__name__))
+            self._start_reading()
+
+            waiter = self._loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if not waiter.done():
+                    # cancelled
+                    self._waiters.remove(waiter)
+
+        return self._get_batch()
+
+    def get_batch_nowait(self):
+        """Remove and return the oldest batch of events
+
+        Exceptions
+        -----------
+        :raises QueueEmpty: No events are available
+        """
+        if not self._head and not self._batches:
+            self._start_reading()
+            raise _asyncio.QueueEmpty
+
+        return self._get_batch()
+
+    async def get_event(self):
+        """Remove and return a single event, waiting for one if the queue is empty"""
+        if not self._head:
+            self._head.extend(await self.get_batch())
+        return self._head.popleft()
+
+    def get_event_nowait(self):
+        """Remove and return a single event
+
+        Exceptions
+        -----------
+        :raises QueueEmpty: No events are available
+        """
+        if not self._head:
+            self._head.extend(self.get_batch_nowait())
+        return self._head.popleft()
+
+    async def batches(self):
+        """Iterate over batches of events as they arrive until the object is closed"""
+        while True:
+            try:
+                batch = await self.get_batch()
+            except EOFError:
+                return
+            yield batch
+
+    @property
+    def maxsize(self):
+        """Number of events queued before reading is paused"""
+        return self._maxsize
+
+    @property
+    def paused(self):
+        """True if reading is paused because the queue is full"""
+        return self._paused
+
+    @property
+    def overflows(self):
+        """Number of times the kernel queue overflowed and events were lost"""
+        return self._source.overflows
+
+    def qsize(self):
+        """Returns the current size of the Queue
+
+        Returns
+        --------
+        int: The number of events read from the kernel but not yet consumed
+        """
+        return self._queued + len(self._head)
+
+    def _get_batch(self):
+        if self._head:
+            batch = list(self._head)
+            self._head.clear()
+            return batch
+
+        batch = self._batches.popleft()
+        self._queued -= len(batch)
+        if self._paused and self._queued <= self._low_water:
+            self._paused = False
+            self._start_reading()
+
+        return batch
+
+    def _start_reading(self):
+        if not self._reading and not self._paused and not self._closed:
+            self._loop.add_reader(self._source.fileno(), self._read_ready)
+            self._reading = True
+
+    def _stop_reading(self):
+        if self._reading:
+            self._loop.remove_reader(self._source.fileno())
+            self._reading = False
+
+    def _read_ready(self):
+        """Read a batch of events from the fd and wake any consumers"""
+        try:
+            events = self._source.read_events()
+        except BlockingIOError:
+            return
+
+        if not events:
+            return
+
+        self._batches.append(events)
+        self._queued += len(events)
+
+        if self._maxsize > 0 and self._queued >= self._maxsize:
+            self._stop_reading()
+            self._paused = True
+            self.pauses += 1
+
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def close(self):
+        self._stop_reading()
+        self._closed = True
+        self._source.close()
+        self._wake_waiters()
@@ -13,6 +13,12 @@ ffi.cdef("""
 #define FAN_UNLIMITED_QUEUE ...
 #define FAN_UNLIMITED_MARKS ...
 
+// fd-less modes, events carry file handles in info records instead of an fd
+#define FAN_REPORT_FID ...
+#define FAN_REPORT_DIR_FID ...
+#define FAN_REPORT_NAME ...
+#define FAN_REPORT_DFID_NAME ...
+
 #define FAN_MARK_ADD ...
 #define FAN_MARK_REMOVE ...
 #define FAN_MARK_DONT_FOLLOW ...
@@ -21,6 +27,7 @@ ffi.cdef("""
 #define FAN_MARK_IGNORED_MASK ...
 #define FAN_MARK_IGNORED_SURV_MODIFY ...
 #define FAN_MARK_FLUSH ...
+#define FAN_MARK_FILESYSTEM ...
 
 #define FAN_ALL_MARK_FLAGS ...
 
@@ -35,6 +42,19 @@ ffi.cdef("""
 #define FAN_ONDIR ...
 #define FAN_EVENT_ON_CHILD ...
 
+// Only reported with FAN_REPORT_FID/FAN_REPORT_DIR_FID
+#define FAN_ATTRIB ...
+#define FAN_MOVED_FROM ...
+#define FAN_MOVED_TO ...
+#define FAN_CREATE ...
+#define FAN_DELETE ...
+#define FAN_DELETE_SELF ...
+#define FAN_MOVE_SELF ...
+#define FAN_MOVE ...
+
+// fd of events that do not carry one
+#define FAN_NOFD ...
+
 // FAN_CLOSE_WRITE|FAN_CLOSE_NOWRITE
 #define FAN_CLOSE ...
 
@@ -63,13 +83,41 @@ struct fanotify_event_metadata {
 };
 
 
+#define FAN_EVENT_INFO_TYPE_FID ...
+#define FAN_EVENT_INFO_TYPE_DFID_NAME ...
+#define FAN_EVENT_INFO_TYPE_DFID ...
+
+struct fanotify_event_info_header {
+    uint8_t info_type;
+    uint8_t pad;
+    uint16_t len;
+};
+
+// followed by a struct file_handle (and a NUL terminated name for DFID_NAME)
+struct fanotify_event_info_fid {
+    struct fanotify_event_info_header hdr;
+    ...;
+};
+
 int fanotify_init(unsigned int flags, unsigned int event_f_flags);
 int fanotify_mark (int fanotify_fd, unsigned int flags, uint64_t mask, int dfd, const char *pathname);
+int fanotify_fsid(int fd, int32_t *fsid);
 """)
 
 ffi.set_source("_fanotify_c", """
 #include <linux/fcntl.h>
 #include <sys/fanotify.h>
+#include <sys/vfs.h>
+#include <string.h>
+
+/* The fsid of the filesystem fd is on, as reported in fanotify_event_info_fid records */
+int fanotify_fsid(int fd, int32_t *fsid) {
+    struct statfs buf;
+    if (fstatfs(fd, &buf) < 0)
+        return -1;
+    memcpy(fsid, &buf.f_fsid, sizeof(buf.f_fsid));
+    return 0;
+}
 """, libraries=[])
 
 if __name__ == "__main__":
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""dirstate: answer 'what changed since token T' for a directory tree using inotify"""
+
+from .inotify import RecursiveInotify as _RecursiveInotify
+from .inotify import CRAWL_WORKERS as _CRAWL_WORKERS
+from .inotify import IN_NONBLOCK, IN_CREATE, IN_DELETE, IN_MODIFY, IN_ATTRIB
+from .inotify import IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_ISDIR
+
+from collections import namedtuple as _namedtuple
+from collections import OrderedDict as _OrderedDict
+import os as _os
+
+# Events that change what is recorded for a path
+DIRSTATE_EVENTS = IN_CREATE | IN_DELETE | IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+_REMOVED = IN_DELETE | IN_MOVED_FROM
+
+# Number of deletions remembered before the oldest are forgotten
+MAX_TOMBSTONES = 64 * 1024
+
+FileState = _namedtuple("FileState", "path inode size mtime_ns is_dir seq")
+class FileState(FileState):
+    """The recorded state of a path and the sequence number it last changed
+    at, a deleted path (tombstone) has an inode, size and mtime_ns of None"""
+    __slots__ = []
+
+    @property
+    def deleted(self):
+        return self.inode is None
+
+Delta = _namedtuple("Delta", "seq changes reset")
+
+
+class DirectoryState(object):
+    """An in memory index of a directory tree kept up to date by inotify
+
+    Every path in the tree is recorded along with its inode, size and
+    mtime_ns and the sequence number of the last change to it. Callers keep
+    the seq from the last Delta they saw and pass it to changes_since() to
+    get only what has changed since, rather than walking the tree
+
+    Deleted paths are kept as tombstones so they can be reported, once
+    more than max_tombstones have built up the oldest are forgotten and the
+    horizon moves forward. Asking for the changes since a seq older than
+    the horizon returns every live path with reset set, the caller must
+    then discard what it knew and start again from the listing
+
+    >>> state = DirectoryState('/srv/build')
+    >>> delta = state.changes_since(0)   # everything
+    >>> ...
+    >>> delta = state.changes_since(delta.seq)
+    >>> for change in delta.changes:
+    ...     invalidate(change.path)
+    """
+    def __init__(self, path, include=None, exclude=None, max_tombstones=MAX_TOMBSTONES, workers=_CRAWL_WORKERS,
+                 max_watches=None):
+        """Crawl and start watching the tree at path
+
+        Arguments
+        ----------
+        :param str path: The directory to index
+        :param list include: Only index files matching these glob patterns
+        :param list exclude: Never index files/dirs matching these glob patterns
+        :param int max_tombstones: Number of deletions to remember before compacting
+        :param int workers: Number of threads to crawl the tree with
+        :param int max_watches: Maximum number of inotify watches to hold (see RecursiveInotify)
+
+        Exceptions
+        -----------
+        :raises ValueError: path does not exist or is not a directory
+        :raises OSError: Maximum number of watches hit
+        """
+        self._inotify = _RecursiveInotify(DIRSTATE_EVENTS, IN_NONBLOCK, snapshot=True,
+                                          include=include, exclude=exclude, max_watches=max_watches)
+        self._max_tombstones = max_tombstones
+
+        # path -> FileState ordered by seq, holds tombstones as well
+        self._entries = _OrderedDict()
+        # path -> seq of the tombstones ordered by seq
+        self._tombstones = _OrderedDict()
+        self._horizon = 0
+
+        self._inotify.watch(path, workers=workers)
+
+        # everything found by the crawl is the first change
+        self._seq = 1
+        for entry_path, (inode, size, mtime_ns, is_dir) in self._inotify.entries():
+            self._entries[entry_path] = FileState(entry_path, inode, size, mtime_ns, is_dir, 1)
+
+    @property
+    def seq(self):
+        """The sequence number of the most recent change"""
+        return self._seq
+
+    @property
+    def horizon(self):
+        """changes_since() can only report deletions for seqs at or after this"""
+        return self._horizon
+
+    def get(self, path):
+        """Return the FileState of path or None if it does not exist (as of the last update)"""
+        if isinstance(path, str):
+            path = _os.fsencode(path)
+        state = self._entries.get(path)
+        if state is None or state.deleted:
+            return None
+        return state
+
+    def changes_since(self, seq):
+        """Apply any pending events and return what has changed since seq
+
+        Each path appears at most once with its latest state, in the order
+        the changes were made
+
+        Arguments
+        ----------
+        :param int seq: The seq of the last Delta seen, 0 for everything
+
+        Returns
+        --------
+        :return: The changes (FileStates, tombstones for deleted paths), the seq to pass
+                 next time and whether the caller must reset (seq was before the horizon)
+        :rtype: Delta
+        """
+        self.update()
+
+        if seq < self._horizon:
+            changes = [state for state in self._entries.values() if not state.deleted]
+            return Delta(self._seq, changes, True)
+
+        changes = []
+        for state in reversed(self._entries.values()):
+            if state.seq <= seq:
+                break
+            changes.append(state)
+        changes.reverse()
+
+        return Delta(self._seq, changes, False)
+
+    def update(self):
+        """Read and apply all pending events without blocking
+
+        Returns
+        --------
+        :return: The number of paths that changed
+        :rtype: int
+        """
+        # a burst of events against a path is applied once, in the
+        # position of its last event
+        touched = _OrderedDict()
+        while True:
+            try:
+                events = self._inotify.read_events()
+            except BlockingIOError:
+                break
+            for event in events:
+                if event.path is None or not event.filename:
+                    # overflow (recovered by the snapshot rescan) or against a watched dir itself
+                    continue
+                touched.pop(event.path, None)
+                touched[event.path] = event.mask
+
+        seq = self._seq
+        for path, mask in touched.items():
+            if mask & _REMOVED:
+                self._remove(path, bool(mask & IN_ISDIR))
+            else:
+                self._refresh(path)
+
+        return self._seq - seq
+
+    def _refresh(self, path):
+        entry = self._inotify.get_entry(path)
+        if entry is None and self._inotify.get_wd(_os.path.dirname(path)) is None:
+            # in a subtree that is being polled rather than watched
+            try:
+                stat = _os.lstat(path)
+                entry = (stat.st_ino, stat.st_size, stat.st_mtime_ns, _os.path.isdir(path))
+            except OSError:
+                entry = None
+
+        if entry is None:
+            # gone again, a delete event follows
+            self._remove(path, False)
+            return
+
+        old = self._entries.get(path)
+        if old is not None and old[1:5] == entry:
+            return
+
+        self._record(FileState(path, entry[0], entry[1], entry[2], entry[3], self._seq + 1))
+        self._tombstones.pop(path, None)
+
+    def _remove(self, path, is_dir):
+        old = self._entries.get(path)
+        if old is not None and not old.deleted:
+            self._tombstone(path, old.is_dir)
+
+        if is_dir:
+            # moving a directory out only reports the directory itself
+            prefix = path + b'/'
+            for child in [p for p, state in self._entries.items() if p.startswith(prefix) and not state.deleted]:
+                self._tombstone(child, self._entries[child].is_dir)
+
+    def _tombstone(self, path, is_dir):
+        self._record(FileState(path, None, None, None, is_dir, self._seq + 1))
+        self._tombstones.pop(path, None)
+        self._tombstones[path] = self._seq
+
+        while len(self._tombstones) > self._max_tombstones:
+            oldest, seq = self._tombstones.popitem(last=False)
+            del self._entries[oldest]
+            self._horizon = seq
+
+    def _record(self, state):
+        self._seq = state.seq
+        self._entries.pop(state.path, None)
+        self._entries[state.path] = state
+
+    def fileno(self):
+        """The inotify fd, readable when update() has events to apply"""
+        return self._inotify.fileno()
+
+    def close(self):
+        self._inotify.close()
+
+    def __len__(self):
+        return len(self._entries) - len(self._tombstones)
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def __repr__(self):
+        return "<{} paths={} seq={}>".format(self.__class__.__name__, len(self), self._seq)
@@ -45,8 +45,8 @@ class Eventfd(_Eventlike):
         :return: The current count of the timer
         :rtype: int
         """
-        data = _os.read(self.fileno(), 8)
-        events = str_to_events(data)
+        self._read_into_buffer(8)
+        events = str_to_events(self._buffer)
 
         return events
 
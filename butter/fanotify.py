@@ -1,14 +1,32 @@
 #!/usr/bin/env python
 """fanotify: wrapper around the fanotify family of syscalls for watching for file modifcation"""
 
-from .utils import get_buffered_length as _get_buffered_length
 from .utils import Eventlike as _Eventlike
 from .utils import CLOEXEC_DEFAULT as _CLOEXEC_DEFAULT
 
 from os import O_RDONLY, O_WRONLY, O_RDWR
-from os import read as _read
+from os import O_PATH as _O_PATH
+from os import O_CLOEXEC as _O_CLOEXEC
+from os import O_NONBLOCK as _O_NONBLOCK
+from os import fstat as _fstat
+from os import readlink as _readlink
+from collections import OrderedDict as _OrderedDict
+from collections import Counter as _Counter
+from collections import namedtuple as _namedtuple
+from threading import Lock as _Lock
+from threading import Thread as _Thread
+from select import select as _select
+from heapq import heappush as _heappush
+from heapq import heappop as _heappop
+from itertools import count as _count
+from time import monotonic as _monotonic
+import os as _os
 
-from ._fanotify import fanotify_init, fanotify_mark, str_to_events
+from ._fanotify import fanotify_init, fanotify_mark, fanotify_respond, str_to_events
+from ._fanotify import fanotify_fsid, FanotifyEvent, FanotifyFidEvent
+from ._fanotify import IOV_MAX
+from .fhandle import open_by_handle_at as _open_by_handle_at
+from errno import ENODEV as _ENODEV
 
 # Import all the constants
 from ._fanotify import lib as _lib
@@ -18,17 +36,184 @@ for key in dir(_lib):
         _l[key] = getattr(_lib, key)
 del key, _lib, _l
 
+# Size of the buffer handed to read(), the kernel returns as many whole events
+# as fit so this bounds the batch size. Each event read also opens a file
+# descriptor in this process so this is kept well under the default fd limit
+READ_BUFFER_SIZE = 4096
+
+# Default number of paths remembered by a PathCache
+PATH_CACHE_SIZE = 4096
+
+class PathCache(object):
+    """Remember the paths of recently seen files so FanotifyEvent.filename
+    can skip the readlink() of /proc/self/fd/N for files seen before
+
+    Paths are keyed by (st_dev, st_ino) from an fstat of the event fd and
+    checked against st_ctime_ns, which the kernel bumps when a file is
+    modified or renamed, so either makes the next lookup resolve the path
+    again. A file with several hard links is reported under the name it
+    was first resolved by. Deleted files are never cached
+
+    >>> notifier = Fanotify(FAN_CLASS_NOTIF, path_cache=PATH_CACHE_SIZE)
+    >>> notifier.path_cache.hits
+    """
+    def __init__(self, maxsize=PATH_CACHE_SIZE):
+        """Arguments
+        ----------
+        :param int maxsize: Number of paths to remember, the least recently used are forgotten first
+        """
+        self._maxsize = maxsize
+        self._paths = _OrderedDict() # (st_dev, st_ino) -> (st_ctime_ns, path)
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, fd):
+        """Return the path of the file open as fd
+
+        Exceptions
+        -----------
+        :raises OSError: fd is not open
+        """
+        stat = _fstat(fd)
+        key = (stat.st_dev, stat.st_ino)
+        paths = self._paths
+
+        cached = paths.get(key)
+        if cached is not None and cached[0] == stat.st_ctime_ns:
+            paths.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        path = _readlink('/proc/self/fd/{}'.format(fd))
+        if path.endswith(' (deleted)'):
+            paths.pop(key, None)
+            return path
+
+        paths[key] = (stat.st_ctime_ns, path)
+        paths.move_to_end(key)
+        if len(paths) > self._maxsize:
+            paths.popitem(last=False)
+
+        return path
+
+    def invalidate(self, fd):
+        """Forget the path of the file open as fd"""
+        stat = _fstat(fd)
+        self._paths.pop((stat.st_dev, stat.st_ino), None)
+
+    def clear(self):
+        self._paths.clear()
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __repr__(self):
+        return "<{} size={} hits={} misses={}>".format(self.__class__.__name__, len(self), self.hits, self.misses)
+
+class HandleResolver(object):
+    """Turn the file handles carried by FanotifyFidEvents back into paths
+
+    open_by_handle_at() needs an fd on the filesystem the handle belongs
+    to, one is kept open per fsid for every path passed to add_mount()
+    (Fanotify does this for every path it watches in the fd-less modes).
+    Handles are only opened, with O_PATH, when an event's filename is
+    asked for. This needs CAP_DAC_READ_SEARCH
+
+    >>> notifier = Fanotify(FAN_CLASS_NOTIF | FAN_REPORT_DFID_NAME)
+    >>> notifier.watch('/srv', FAN_CREATE | FAN_DELETE | FAN_ONDIR, FAN_MARK_FILESYSTEM)
+    >>> event = notifier.read_event()
+    >>> event.dir_handle, event.name   # no syscalls
+    >>> event.filename                 # open_by_handle_at + readlink
+    """
+    def __init__(self):
+        self._mounts = {} # fsid -> fd
+
+    def add_mount(self, path):
+        """Keep an fd open on the filesystem path is on so handles from it can be resolved
+
+        Returns
+        --------
+        :return: The fsid of the filesystem
+        :rtype: tuple of 2 ints
+        """
+        # open_by_handle_at() will not take an O_PATH fd as its mount_fd
+        fd = _os.open(path, O_RDONLY | _O_NONBLOCK | _O_CLOEXEC)
+        try:
+            fsid = fanotify_fsid(fd)
+        except OSError:
+            _os.close(fd)
+            raise
+
+        if fsid in self._mounts:
+            _os.close(fd)
+        else:
+            self._mounts[fsid] = fd
+
+        return fsid
+
+    def __call__(self, fsid, handle, name=None):
+        """Return the path of the file identified by handle on the
+        filesystem identified by fsid, joined with name if given
+
+        Exceptions
+        -----------
+        :raises OSError: No fd is open on the filesystem or the handle can not be opened
+        :raises StaleHandle: The file has been deleted
+        """
+        mount_fd = self._mounts.get(fsid)
+        if mount_fd is None:
+            raise OSError(_ENODEV, "No mount added for fsid {}".format(fsid))
+
+        fd = _open_by_handle_at(mount_fd, handle, _O_PATH)
+        try:
+            path = _readlink('/proc/self/fd/{}'.format(fd))
+        finally:
+            _os.close(fd)
+
+        # '.' is reported for events against the directory itself
+        if name is not None and name != '.':
+            path = _os.path.join(path, name)
+
+        return path
+
+    def close(self):
+        for fd in self._mounts.values():
+            _os.close(fd)
+        self._mounts.clear()
+
+    def __len__(self):
+        return len(self._mounts)
+
+    def __repr__(self):
+        return "<{} mounts={}>".format(self.__class__.__name__, len(self))
+
 class Fanotify(_Eventlike):
     blocking = True
+    # number of times the kernel queue overflowed (FAN_Q_OVERFLOW) and events were lost
+    overflows = 0
     
-    def __init__(self, flags, event_flags=O_RDONLY, closefd=_CLOEXEC_DEFAULT):
+    def __init__(self, flags, event_flags=O_RDONLY, closefd=_CLOEXEC_DEFAULT, buffer_size=READ_BUFFER_SIZE,
+                 path_cache=0):
+        """Arguments
+        ----------
+        :param int flags: Flags to pass to fanotify_init (FAN_CLASS_*, FAN_NONBLOCK, FAN_CLOEXEC)
+        :param int event_flags: Flags the event fds are opened with (O_RDONLY, O_RDWR, ...)
+        :param int buffer_size: Size of the buffer events are read into
+        :param int path_cache: Remember the filenames of this many files (see PathCache), 0 to resolve every event
+
+        With FAN_REPORT_FID/FAN_REPORT_DIR_FID in flags no fd is opened per
+        event, FanotifyFidEvents are returned instead and resolved by the
+        HandleResolver in the handles attribute
+        """
         super(Fanotify, self).__init__()
         self._fd = fanotify_init(flags, event_flags, closefd=closefd)
-
-        self._events = []
+        self._buffer_size = buffer_size
+        self.path_cache = PathCache(path_cache) if path_cache else None
+        self.handles = HandleResolver() if flags & (FAN_REPORT_FID | FAN_REPORT_DIR_FID) else None
 
         if flags & FAN_NONBLOCK:
-            self.blocking = false
+            self.blocking = False
         
         if event_flags & O_RDWR|O_WRONLY:
             self._mode = 'w+'
@@ -40,6 +225,8 @@ class Fanotify(_Eventlike):
     def watch(self, path, mask, flags=0, dfd=0):
         flags |= FAN_MARK_ADD
         fanotify_mark(self.fileno(), path, mask, flags, dfd)
+        if self.handles is not None and path is not None:
+            self.handles.add_mount(path)
 
     def del_watch(self, path, mask, flags=0, dfd=0):
         self.ignore(path, mask, flags, dfd)
@@ -48,11 +235,401 @@ class Fanotify(_Eventlike):
         flags |= FAN_MARK_REMOVE
         fanotify_mark(self.fileno(), path, mask, flags, dfd)
 
+    def respond(self, events, response=FAN_ALLOW):
+        """Answer permission events (FAN_OPEN_PERM/FAN_ACCESS_PERM) and close their fds
+
+        Every response is written in a single writev() (per IOV_MAX
+        events) rather than a write() per event, the processes blocked on
+        the events are released as soon as it returns
+
+        Arguments
+        ----------
+        :param list events: The FanotifyEvents to answer
+        :param int response: FAN_ALLOW or FAN_DENY for every event, or a list with one per event
+
+        Returns
+        --------
+        :return: The number of responses accepted (events already answered are skipped)
+        :rtype: int
+
+        Exceptions
+        -----------
+        :raises ValueError: A response is not FAN_ALLOW/FAN_DENY or there is not one per event
+        """
+        events = list(events)
+        if isinstance(response, int):
+            responses = [(event.fd, response) for event in events]
+        else:
+            response = list(response)
+            if len(response) != len(events):
+                # an event that is closed without an answer blocks its process until we exit
+                raise ValueError("Need exactly one response per event")
+            responses = [(event.fd, verdict) for event, verdict in zip(events, response)]
+
+        try:
+            return fanotify_respond(self.fileno(), responses)
+        finally:
+            for event in events:
+                if event.fd is not None and event.fd >= 0:
+                    event.close()
+
+    def close(self):
+        if self.handles is not None:
+            self.handles.close()
+        super(Fanotify, self).close()
+
     def _read_events(self):
-        fd = self.fileno()
+        # a single read, blocks (or raises BlockingIOError) if the queue is empty
+        length = self._read_into_buffer(self._buffer_size)
 
-        raw_events = _read(fd, _get_buffered_length(fd))
+        resolver = self.handles if self.handles is not None else self.path_cache
+        events = str_to_events(self._buffer, length, resolver)
 
-        events = str_to_events(raw_events)
+        for event in events:
+            if event.mask & FAN_Q_OVERFLOW:
+                self.overflows += 1
 
         return events
+
+
+# Default number of verdicts remembered by a VerdictCache
+VERDICT_CACHE_SIZE = 16 * 1024
+
+class VerdictCache(object):
+    """Remember the verdicts given to files so permission events for files
+    that have not changed since can be answered without deciding again
+
+    Verdicts are keyed by (st_dev, st_ino) from an fstat of the event fd
+    and only replayed while the file's mtime_ns and size match those seen
+    when it was decided. invalidate() (called for FAN_MODIFY/FAN_CLOSE_WRITE
+    events) forgets a file outright, this covers writes that do not move
+    the mtime on filesystems with coarse timestamps, and a verdict decided
+    while its file was invalidated is not stored. The least recently used
+    verdicts are forgotten first. Safe to use from several threads
+
+    >>> ticket, verdict = cache.lookup(event.fd)
+    >>> if verdict is None:
+    ...     verdict = decide(event)
+    ...     cache.store(ticket, verdict)
+    """
+    def __init__(self, maxsize=VERDICT_CACHE_SIZE):
+        """Arguments
+        ----------
+        :param int maxsize: Number of files to remember verdicts for
+        """
+        self._maxsize = maxsize
+        self._lock = _Lock()
+        # (st_dev, st_ino) -> (mtime_ns, size, verdict, stamp), verdict is None once invalidated
+        self._verdicts = _OrderedDict()
+        self._stamps = _count(1)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, fd):
+        """Return the verdict for the file open as fd if it is cached
+
+        Returns
+        --------
+        :return: A ticket to pass to store() and the cached verdict (None if not cached)
+        :rtype: tuple
+
+        Exceptions
+        -----------
+        :raises OSError: fd is not open
+        """
+        stat = _fstat(fd)
+        key = (stat.st_dev, stat.st_ino)
+
+        with self._lock:
+            entry = self._verdicts.get(key)
+            if entry is None:
+                self.misses += 1
+                return (key, stat.st_mtime_ns, stat.st_size, None), None
+
+            if entry[2] is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                self._verdicts.move_to_end(key)
+                self.hits += 1
+                return None, entry[2]
+
+            self.misses += 1
+            return (key, stat.st_mtime_ns, stat.st_size, entry[3]), None
+
+    def store(self, ticket, verdict):
+        """Remember verdict for the file ticket was returned for by lookup(),
+        unless the file has been invalidated (or decided) since"""
+        key, mtime_ns, size, stamp = ticket
+        verdicts = self._verdicts
+
+        with self._lock:
+            entry = verdicts.get(key)
+            if (entry[3] if entry is not None else None) != stamp:
+                return
+
+            verdicts[key] = (mtime_ns, size, verdict, next(self._stamps))
+            verdicts.move_to_end(key)
+            if len(verdicts) > self._maxsize:
+                verdicts.popitem(last=False)
+
+    def invalidate(self, fd):
+        """Forget the verdict for the file open as fd"""
+        stat = _fstat(fd)
+        key = (stat.st_dev, stat.st_ino)
+        verdicts = self._verdicts
+
+        with self._lock:
+            # kept as an entry so a decision already under way is not stored
+            verdicts[key] = (None, None, None, next(self._stamps))
+            verdicts.move_to_end(key)
+            if len(verdicts) > self._maxsize:
+                verdicts.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._verdicts.clear()
+
+    def __len__(self):
+        return len(self._verdicts)
+
+    def __repr__(self):
+        return "<{} size={} hits={} misses={}>".format(self.__class__.__name__, len(self), self.hits, self.misses)
+
+# Default number of threads deciding permission events
+PERMISSION_WORKERS = 8
+# Default seconds a permission event may wait for a decision before it gets the default verdict
+PERMISSION_TIMEOUT = 1.0
+# Events that block the process that caused them until they are answered
+_PERM_EVENTS = FAN_OPEN_PERM | FAN_ACCESS_PERM
+# Events after which a cached verdict can no longer be trusted
+_INVALIDATE_EVENTS = FAN_MODIFY | FAN_CLOSE_WRITE
+
+PermissionStats = _namedtuple("PermissionStats", "answered timeouts errors cached latency decide_latency")
+
+def _log2_bucket(seconds):
+    """The histogram bucket for a latency, the smallest power of 2 microseconds it fits in"""
+    return 1 << int(seconds * 1000000).bit_length()
+
+class PermissionServer(object):
+    """Answer fanotify permission events (FAN_OPEN_PERM/FAN_ACCESS_PERM)
+    from a pool of worker threads
+
+    A reader thread reads batches of events and hands each permission
+    event to decide(event) on a worker, which returns FAN_ALLOW or
+    FAN_DENY. The answer is written as soon as decide returns so one slow
+    decision does not hold up the rest of the batch. An event that is not
+    decided within timeout seconds of being read gets the default verdict
+    (decide carries on and its verdict is thrown away), as does one whose
+    decide raises. The event fd stays open until decide returns so it can
+    be read from, other events read alongside are closed straight away
+
+    stats() reports two histograms keyed by the smallest power of 2
+    microseconds each sample fits in: latency, from the event being read
+    to it being answered (the delay added to the blocked open()), and
+    decide_latency, the time spent in decide
+
+    If verdict_cache is set the verdicts returned by decide are cached
+    (see VerdictCache) and events for files that have not changed are
+    answered straight from the reader thread. Add FAN_MODIFY and
+    FAN_CLOSE_WRITE to the watched mask so writes invalidate the cache
+
+    >>> def decide(event):
+    ...     return FAN_DENY if is_malware(event.fd) else FAN_ALLOW
+    >>> server = PermissionServer(decide, timeout=0.5)
+    >>> server.watch('/srv', FAN_OPEN_PERM, FAN_MARK_MOUNT)
+    >>> server.start()
+    """
+    def __init__(self, decide, workers=PERMISSION_WORKERS, timeout=PERMISSION_TIMEOUT, default=FAN_ALLOW,
+                 event_flags=O_RDONLY, path_cache=0, verdict_cache=0):
+        """Arguments
+        ----------
+        :param callable decide: Called as decide(event) on a worker thread, returns FAN_ALLOW or FAN_DENY
+        :param int workers: Number of worker threads
+        :param float timeout: Seconds to wait for decide before answering with default, None to wait forever
+        :param int default: The verdict given on timeout or if decide raises
+        :param int event_flags: Flags the event fds are opened with
+        :param int path_cache: Remember the filenames of this many files (see PathCache)
+        :param int verdict_cache: Remember the verdicts for this many files (see VerdictCache)
+        """
+        self._decide = decide
+        self._workers = workers
+        self._timeout = timeout
+        self._default = default
+        self._fanotify = Fanotify(FAN_CLASS_CONTENT | FAN_NONBLOCK, event_flags, path_cache=path_cache)
+        self.verdict_cache = VerdictCache(verdict_cache) if verdict_cache else None
+
+        # answering and closing an event fd are serialised by _lock so an
+        # answer is never written to an fd number that has been reused
+        self._lock = _Lock()
+        self._pending = {} # token -> (event, time read) until answered
+        self._deadlines = [] # heap of (deadline, token), only touched by the reader
+        self._tokens = _count()
+        self._pool = None
+        self._thread = None
+        self._stop_r = self._stop_w = None
+
+        self.answered = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.cached = 0
+        self._latency = _Counter()
+        self._decide_latency = _Counter()
+
+    def watch(self, path, mask=FAN_OPEN_PERM, flags=0, dfd=0):
+        self._fanotify.watch(path, mask, flags, dfd)
+
+    def ignore(self, path, mask=FAN_OPEN_PERM, flags=0, dfd=0):
+        self._fanotify.ignore(path, mask, flags, dfd)
+
+    def start(self):
+        """Start the reader thread and the worker pool"""
+        assert self._thread is None, "already started"
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._pool = ThreadPoolExecutor(self._workers)
+        self._stop_r, self._stop_w = _os.pipe()
+        self._thread = _Thread(target=self._reader, name="fanotify permission reader")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _reader(self):
+        fanotify = self._fanotify
+        stop = self._stop_r
+        deadlines = self._deadlines
+
+        while True:
+            timeout = None
+            if deadlines:
+                timeout = max(deadlines[0][0] - _monotonic(), 0)
+
+            ready, _, _ = _select([fanotify, stop], [], [], timeout)
+            if stop in ready:
+                return
+
+            if ready:
+                try:
+                    events = fanotify.read_events()
+                except BlockingIOError:
+                    events = []
+                self._dispatch(events)
+
+            now = _monotonic()
+            while deadlines and deadlines[0][0] <= now:
+                _, token = _heappop(deadlines)
+                self._answer(token, self._default, timed_out=True)
+
+    def _dispatch(self, events):
+        cache = self.verdict_cache
+        now = _monotonic()
+        for event in events:
+            if not event.mask & _PERM_EVENTS:
+                # nothing is waiting on it
+                if event.fd >= 0:
+                    if cache is not None and event.mask & _INVALIDATE_EVENTS:
+                        cache.invalidate(event.fd)
+                    event.close()
+                continue
+
+            token = next(self._tokens)
+            with self._lock:
+                self._pending[token] = (event, now)
+
+            ticket = None
+            if cache is not None:
+                try:
+                    ticket, verdict = cache.lookup(event.fd)
+                except OSError:
+                    verdict = None
+                if verdict is not None:
+                    self._answer(token, verdict, cached=True)
+                    with self._lock:
+                        event.close()
+                    continue
+
+            if self._timeout is not None:
+                _heappush(self._deadlines, (now + self._timeout, token))
+            self._pool.submit(self._run, token, event, ticket)
+
+    def _run(self, token, event, ticket):
+        try:
+            # not worth deciding if it timed out while queued
+            if token in self._pending:
+                start = _monotonic()
+                try:
+                    verdict = self._decide(event)
+                except Exception:
+                    verdict = None
+
+                with self._lock:
+                    self._decide_latency[_log2_bucket(_monotonic() - start)] += 1
+                    if verdict is None:
+                        self.errors += 1
+                if verdict is not None and ticket is not None:
+                    # still valid for next time even if it came too late for this event
+                    self.verdict_cache.store(ticket, verdict)
+                self._answer(token, self._default if verdict is None else verdict)
+        finally:
+            with self._lock:
+                event.close()
+
+    def _answer(self, token, verdict, timed_out=False, cached=False):
+        with self._lock:
+            pending = self._pending.pop(token, None)
+            if pending is None:
+                # already answered
+                return
+            event, read_at = pending
+
+            fanotify_respond(self._fanotify.fileno(), [(event.fd, verdict)])
+
+            self._latency[_log2_bucket(_monotonic() - read_at)] += 1
+            self.answered += 1
+            if timed_out:
+                self.timeouts += 1
+            if cached:
+                self.cached += 1
+
+    def stats(self):
+        """Return the number of events answered, timed out, whose decide
+        raised and answered from the verdict cache along with the latency
+        histograms
+
+        Returns
+        --------
+        :return: The counters so far
+        :rtype: PermissionStats
+        """
+        with self._lock:
+            return PermissionStats(self.answered, self.timeouts, self.errors, self.cached,
+                                   dict(self._latency), dict(self._decide_latency))
+
+    def stop(self):
+        """Stop reading events, events still waiting for a decision are
+        given the default verdict and the workers are waited for"""
+        if self._thread is None:
+            return
+
+        _os.write(self._stop_w, b'x')
+        self._thread.join()
+
+        with self._lock:
+            tokens = list(self._pending)
+        for token in tokens:
+            self._answer(token, self._default)
+
+        self._pool.shutdown(wait=True)
+        _os.close(self._stop_r)
+        _os.close(self._stop_w)
+        self._thread = self._pool = None
+        self._stop_r = self._stop_w = None
+        self._deadlines[:] = []
+
+    def fileno(self):
+        return self._fanotify.fileno()
+
+    def close(self):
+        self.stop()
+        self._fanotify.close()
+
+    def __repr__(self):
+        fd = self._fanotify._fd or "closed"
+        return "<{} fd={} workers={} pending={}>".format(self.__class__.__name__, fd, self._workers,
+                                                          len(self._pending))
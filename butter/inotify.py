@@ -1,17 +1,33 @@
 #!/usr/bin/env python
 """inotify: Wrapper around the inotify syscalls providing both a function based and file like interface"""
 
-from .utils import get_buffered_length as _get_buffered_length
 from .utils import Eventlike as _Eventlike
 from .utils import CLOEXEC_DEFAULT as _CLOEXEC_DEFAULT
 
 from ._inotify import inotify_init, inotify_add_watch, inotify_rm_watch
-from ._inotify import str_to_events
+from ._inotify import str_to_events, str_to_batch, str_to_lazy_events
+from ._inotify import InotifyEvent, InotifyPathEvent, InotifyBatch, LazyInotifyEvent
+from ._inotify import EVENT_SIZE_MAX
 from ._inotify import event_name
+from .utils import PermissionError as _PermissionError
 
-from errno import EINVAL as _EINVAL
-
+from collections import namedtuple as _namedtuple
+from collections import deque as _deque
+from collections import OrderedDict as _OrderedDict
+from collections import Counter as _Counter
+from select import select as _select
+from time import time as _time
+from time import monotonic as _monotonic
+from time import perf_counter as _perf_counter
+from fnmatch import translate as _translate
+from threading import Lock as _Lock
+from threading import Thread as _Thread
+from zlib import crc32 as _crc32
+from errno import ENOSPC as _ENOSPC
 import os as _os
+import re as _re
+import struct as _struct
+import mmap as _mmap
 
 # Import all the constants
 from ._inotify import lib as _lib
@@ -21,22 +37,162 @@ for key in dir(_lib):
         _l[key] = getattr(_lib, key)
 del key, _lib, _l
 
+# The single bit flags that can be set in an event's mask (the inotify_init
+# flags share values with some of them)
+_EVENT_BITS = sorted((value, name) for name, value in event_name.items()
+                     if isinstance(value, int) and not value & (value - 1)
+                     and value & (IN_ALL_EVENTS | IN_Q_OVERFLOW | IN_IGNORED | IN_ISDIR | IN_UNMOUNT)
+                     and name not in ('IN_CLOEXEC', 'IN_NONBLOCK'))
+
+# Size of the buffer handed to read(), the kernel returns as many whole events
+# as fit so this bounds the batch size. 64KiB holds at least 240 events with
+# maximum length (NAME_MAX) filenames and ~4000 events without
+READ_BUFFER_SIZE = 64 * 1024
+
+class PathFilter(object):
+    """Include/exclude glob patterns matched against filenames (not full
+    paths), each set is compiled once into a single regex
+
+    exclude patterns apply to both files and directories, a pattern ending
+    in '/' (eg '.git/', '__pycache__/') only matches directories. include
+    patterns only apply to files, directories are never filtered by them so
+    they can still be descended into. Exclusions win over inclusions
+
+    >>> PathFilter(include=['*.py', '*.so'], exclude=['.git/', '__pycache__/'])
+    """
+    def __init__(self, include=None, exclude=None):
+        """Arguments
+        ----------
+        :param list include: Glob patterns files must match, None to include everything
+        :param list exclude: Glob patterns files and directories must not match
+        """
+        exclude = [_os.fsencode(pattern) for pattern in (exclude or ())]
+        self._include = self._compile(include)
+        self._exclude_file = self._compile([p for p in exclude if not p.endswith(b'/')])
+        self._exclude_dir = self._compile([p.rstrip(b'/') for p in exclude])
+
+    @staticmethod
+    def _compile(patterns):
+        if not patterns:
+            return None
+        regex = b'|'.join(b'(?:' + _os.fsencode(_translate(_os.fsdecode(p))) + b')' for p in patterns)
+        return _re.compile(regex).match
+
+    def __call__(self, filename, is_dir=False):
+        """Return True if filename (bytes) should be kept"""
+        if is_dir:
+            return self._exclude_dir is None or not self._exclude_dir(filename)
+        if self._exclude_file is not None and self._exclude_file(filename):
+            return False
+        return self._include is None or self._include(filename) is not None
+
+    def event_filter(self, wd, mask, filename):
+        """Filter suitable for passing to str_to_events, events against the
+        watched directory itself (no filename) are always kept"""
+        return not filename or self(filename, mask & IN_ISDIR)
+
+    def __repr__(self):
+        return "<{}>".format(self.__class__.__name__)
+
+
+ReadStats = _namedtuple("ReadStats", "events bytes parse_time overflows")
+InotifyStats = _namedtuple("InotifyStats", "reads events bytes parse_time overflows batch_sizes by_wd by_event")
+
+class _StatsCollector(object):
+    """Running totals for an Inotify object, only created when stats are enabled"""
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.reads = 0
+        self.events = 0
+        self.bytes = 0
+        self.parse_time = 0.0
+        self.overflows = 0
+        self.batch_sizes = _Counter() # power of 2 upper bound -> reads
+        self.wds = _Counter()
+        self.masks = _Counter()
+
+    def record(self, wds, masks, length, parse_time, overflows):
+        count = len(masks)
+        self.reads += 1
+        self.events += count
+        self.bytes += length
+        self.parse_time += parse_time
+        self.overflows += overflows
+        self.batch_sizes[1 << (count - 1).bit_length() if count else 0] += 1
+        self.wds.update(wds)
+        # masks are cheap to count as is, they are split into events in snapshot()
+        self.masks.update(masks)
+
+        if self.hook is not None:
+            self.hook(ReadStats(count, length, parse_time, overflows))
+
+    def snapshot(self):
+        by_event = _Counter()
+        for mask, count in self.masks.items():
+            for bit, name in _EVENT_BITS:
+                if mask & bit:
+                    by_event[name] += count
+
+        return InotifyStats(self.reads, self.events, self.bytes, self.parse_time, self.overflows,
+                            dict(self.batch_sizes), dict(self.wds), dict(by_event))
+
+
 class Inotify(_Eventlike):
-    def __init__(self, flags=0, closefd=_CLOEXEC_DEFAULT):
+    # number of times the kernel queue overflowed (IN_Q_OVERFLOW) and events were lost
+    overflows = 0
+
+    def __init__(self, flags=0, closefd=_CLOEXEC_DEFAULT, buffer_size=READ_BUFFER_SIZE, lazy=False,
+                 stats=False, stats_hook=None):
+        """Create a new Inotify object
+
+        Arguments
+        ----------
+        :param int flags: Flags to pass to inotify_init (IN_NONBLOCK, IN_CLOEXEC)
+        :param int buffer_size: Size of the buffer events are read into
+        :param bool lazy: Return LazyInotifyEvents that only copy out their filename when it is accessed
+                          (has no effect on watches with include/exclude filters)
+        :param bool stats: Keep counters of the events read, see stats()
+        :param callable stats_hook: Called with a ReadStats after every read (implies stats)
+        """
+        assert buffer_size >= EVENT_SIZE_MAX, "buffer_size must be able to hold at least one event"
+
         super(Inotify, self).__init__()
         fd = inotify_init(flags, closefd=closefd)
         self._fd = fd
-        
-        self._events = []
+        self._buffer_size = buffer_size
+        self._filters = {} # wd -> PathFilter
+        self._event_filter = None
+        self._lazy = lazy
+        self._stats = _StatsCollector(stats_hook) if stats or stats_hook else None
 
         if flags & IN_NONBLOCK:
             self._blocking = False
         else:
             self._blocking = True
         
-    def watch(self, path, events):
+    def watch(self, path, events, include=None, exclude=None):
+        """Start watching a file or directory for events
+
+        Arguments
+        ----------
+        :param str path: The file/dir to watch
+        :param int events: The IN_* events to watch for
+        :param list include: Only report events for files matching these glob patterns
+        :param list exclude: Never report events for files/dirs matching these glob patterns
+
+        Returns
+        --------
+        :return: The watch descriptor
+        :rtype: int
+        """
         wd = inotify_add_watch(self.fileno(), path, events)
-        
+
+        if include or exclude:
+            self._filters[wd] = PathFilter(include, exclude)
+        else:
+            self._filters.pop(wd, None)
+        self._event_filter = self._filter_event if self._filters else None
+
         return wd
         
     def del_watch(self, wd):
@@ -44,38 +200,1564 @@ class Inotify(_Eventlike):
 
     def ignore(self, wd):
         inotify_rm_watch(self.fileno(), wd)
+        self._filters.pop(wd, None)
+        self._event_filter = self._filter_event if self._filters else None
+
+    def _filter_event(self, wd, mask, filename):
+        path_filter = self._filters.get(wd)
+        return path_filter is None or path_filter.event_filter(wd, mask, filename)
         
     def _read_events(self):
+        # A single read is enough for both blocking and non-blocking fd's:
+        # blockers will block until at least one event is available and
+        # non-blockers will raise BlockingIOError (EAGAIN) if there are none
+        length = self._read_into_buffer(self._buffer_size)
+
+        stats = self._stats
+        if stats is not None:
+            start = _perf_counter()
+
+        if self._lazy and self._event_filter is None:
+            events = str_to_lazy_events(self._buffer, length)
+        else:
+            # filters need the filename so there is nothing to gain from being lazy
+            events = str_to_events(self._buffer, length, self._event_filter)
+
+        overflows = 0
+        for event in events:
+            if event.mask & IN_Q_OVERFLOW:
+                # the kernel dropped events, RecursiveInotify can recover from
+                # this but a plain Inotify can only report it
+                overflows += 1
+        self.overflows += overflows
+
+        if stats is not None:
+            stats.record([event.wd for event in events], [event.mask for event in events],
+                         length, _perf_counter() - start, overflows)
+
+        return events
+
+    def stats(self):
+        """Return a snapshot of the counters kept when stats are enabled
+
+        by_wd and by_event count events per watch descriptor and per IN_*
+        flag (an event with several flags set is counted against each),
+        batch_sizes counts reads by the number of events they returned
+        rounded up to a power of 2 and parse_time is in seconds
+
+        Returns
+        --------
+        :return: The counters or None if stats are not enabled
+        :rtype: InotifyStats
+        """
+        if self._stats is None:
+            return None
+        return self._stats.snapshot()
+
+    def read_batch(self):
+        """Read a batch of events from the kernel as a compact InotifyBatch
+        rather than a list of InotifyEvents
+
+        Events already cached by read_event() are returned first
+
+        Returns
+        --------
+        :return: The events read
+        :rtype: InotifyBatch
+        """
+        if self._events:
+            return InotifyBatch.from_events(self.read_events())
+
+        length = self._read_into_buffer(self._buffer_size)
+
+        stats = self._stats
+        if stats is not None:
+            start = _perf_counter()
+
+        if self._event_filter is not None:
+            batch = InotifyBatch.from_events(str_to_events(self._buffer, length, self._event_filter))
+        else:
+            batch = str_to_batch(self._buffer, length)
+
+        overflows = batch.count(IN_Q_OVERFLOW)
+        self.overflows += overflows
+
+        if stats is not None:
+            stats.record(batch.wd, batch.mask, length, _perf_counter() - start, overflows)
+
+        return batch
+
+WatchLimits = _namedtuple("WatchLimits", "max_user_watches used")
+
+def get_watch_limits():
+    """Read the per user watch limit (fs.inotify.max_user_watches) and count
+    the watches currently held by processes of the current user
+
+    Usage is counted from /proc/<pid>/fdinfo which is only readable for our
+    own processes (or all of them as root), watches held by processes that
+    can not be inspected are not counted
+
+    >>> limits = get_watch_limits()
+    >>> inotify = RecursiveInotify(max_watches=int((limits.max_user_watches - limits.used) * 0.9))
+
+    Returns
+    --------
+    :return: The limit (None if unknown) and number of watches in use
+    :rtype: WatchLimits
+    """
+    try:
+        with open('/proc/sys/fs/inotify/max_user_watches') as f:
+            limit = int(f.read())
+    except (OSError, ValueError):
+        limit = None
+
+    uid = _os.getuid()
+    used = 0
+    for pid in _os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            if _os.stat('/proc/' + pid).st_uid != uid:
+                continue
+            fds = _os.listdir('/proc/{}/fd'.format(pid))
+        except OSError:
+            continue
+
+        for fd in fds:
+            try:
+                if _os.readlink('/proc/{}/fd/{}'.format(pid, fd)) != 'anon_inode:inotify':
+                    continue
+                with open('/proc/{}/fdinfo/{}'.format(pid, fd)) as f:
+                    used += sum(1 for line in f if line.startswith('inotify wd:'))
+            except OSError:
+                # process or fd went away
+                continue
+
+    return WatchLimits(limit, used)
+
+# Default number of threads used to crawl a tree when it is first watched,
+# inotify_add_watch and directory listing both release the GIL
+CRAWL_WORKERS = 8
+# Directories scanned by a crawl worker per task
+_CRAWL_BATCH = 256
+
+CrawlProgress = _namedtuple("CrawlProgress", "directories elapsed done")
+
+# returned by _scan_dir in place of a wd when the watch budget is exhausted
+_NO_SPACE = object()
+
+class _Quota(object):
+    """Number of watches crawl workers may still add, shared between threads"""
+    def __init__(self, remaining):
+        self._remaining = remaining
+        self._lock = _Lock()
+
+    def take(self):
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+def _snapshot_entry(stat, is_dir):
+    """The details kept for a file in a RecursiveInotify snapshot, a change
+    in any of them is reported as a modification"""
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns, is_dir)
+
+def _scan_dir(fd, mask, path, wd=None, want_entries=False, want_stats=False, path_filter=None, quota=None,
+              owns=None):
+    """Arm a watch on path (unless wd is given) and then list it
+
+    The watch is always armed before the directory is listed so anything
+    created after the listing generates an event and anything created
+    before it is in the listing. This is safe to run in a worker thread as
+    it does not touch any shared state
+
+    Returns (path, wd, subdirs, entries) where entries is a list of
+    (name, path, is_dir, snapshot) if want_entries is set (snapshot is
+    None unless want_stats is set), wd is None if the directory could
+    not be watched and _NO_SPACE if quota or the kernel ran out of
+    watches. Entries rejected by path_filter (called with the name) or
+    owns (called with the path) are left out of both
+    """
+    if wd is None:
+        if quota is not None and not quota.take():
+            return path, _NO_SPACE, (), ()
+        try:
+            wd = inotify_add_watch(fd, path, mask)
+        except (ValueError, _PermissionError):
+            # removed, replaced by a non-directory or unreadable
+            return path, None, (), ()
+        except OSError as err:
+            if err.errno != _ENOSPC:
+                raise
+            return path, _NO_SPACE, (), ()
+
+    subdirs = []
+    entries = []
+    try:
+        listing = list(_os.scandir(path))
+    except OSError:
+        listing = ()
+
+    for entry in listing:
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            continue
+
+        if path_filter is not None and not path_filter(entry.name, is_dir):
+            continue
+        if owns is not None and not owns(entry.path, is_dir):
+            continue
+
+        if is_dir:
+            subdirs.append(entry.path)
+        if want_entries:
+            snapshot = None
+            if want_stats:
+                try:
+                    snapshot = _snapshot_entry(entry.stat(follow_symlinks=False), is_dir)
+                except OSError:
+                    continue
+            entries.append((entry.name, entry.path, is_dir, snapshot))
+
+    return path, wd, subdirs, entries
+
+def _scan_tree(fd, mask, stack, limit, want_stats=False, path_filter=None, quota=None, owns=None):
+    """Run _scan_dir depth first over the (path, wd) pairs in stack until
+    limit directories have been scanned, batching work this way keeps the
+    per task overhead of a thread pool off the per directory cost
+
+    Returns the scan results in the order they were scanned (parents
+    before children) and the unscanned remainder of the stack. owns is only
+    applied to the entries of the root (the only entry with a wd)
+    """
+    results = []
+    while stack and len(results) < limit:
+        path, wd = stack.pop()
+        result = _scan_dir(fd, mask, path, wd, want_stats, want_stats, path_filter, quota,
+                           owns if wd is not None else None)
+        results.append(result)
+        stack.extend((subdir, None) for subdir in result[2])
+
+    return results, stack
+
+# Events RecursiveInotify needs from every directory to keep its index up to date
+_TREE_EVENTS = IN_CREATE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+# Events needed to keep a RecursiveInotify snapshot up to date
+_SNAPSHOT_EVENTS = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE
+# Events after which a snapshot entry needs to be refreshed
+_SNAPSHOT_UPDATE = IN_CREATE | IN_MOVED_TO | IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE
+# Events delivered from a RecursiveInotify regardless of the requested mask
+_ALWAYS_DELIVERED = IN_Q_OVERFLOW | IN_UNMOUNT
+
+# RecursiveInotify checkpoint file layout (little endian):
+#   header: magic, version, flags, number of directories
+#   per directory: inode, mtime_ns, path length, number of entries, path
+#   per entry: inode, size, mtime_ns, is_dir, name length, name (with _CHECKPOINT_STATS)
+#              name length, name of each subdirectory (without)
+_CHECKPOINT_MAGIC = b'BINO'
+_CHECKPOINT_VERSION = 1
+_CHECKPOINT_STATS = 1
+_checkpoint_header = _struct.Struct('<4sHHI')
+_checkpoint_dir = _struct.Struct('<QqHI')
+_checkpoint_entry = _struct.Struct('<QQqBB')
+_checkpoint_name = _struct.Struct('<B')
+# directories modified this recently when a checkpoint is saved may have
+# events still queued that the index has not seen, they are always rescanned
+_CHECKPOINT_GRACE = 2 * 10**9
+
+CheckpointRestore = _namedtuple("CheckpointRestore", "directories rescanned elapsed")
+
+def _load_checkpoint(filename, want_stats):
+    """Read a checkpoint written by RecursiveInotify.save_checkpoint()
+
+    Returns {path: (inode, mtime_ns, entries)} where entries maps names to
+    snapshot entries if want_stats is set and is a list of subdirectory
+    names otherwise, None if the file is missing, unreadable or was saved
+    with/without a snapshot when the other was wanted
+    """
+    try:
+        with open(filename, 'rb') as f:
+            data = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # missing or empty
+        return None
+
+    dirs = {}
+    try:
+        magic, version, flags, count = _checkpoint_header.unpack_from(data, 0)
+        if magic != _CHECKPOINT_MAGIC or version != _CHECKPOINT_VERSION:
+            return None
+        if bool(flags & _CHECKPOINT_STATS) != bool(want_stats):
+            return None
+
+        dir_unpack = _checkpoint_dir.unpack_from
+        dir_size = _checkpoint_dir.size
+        entry_unpack = _checkpoint_entry.unpack_from
+        entry_size = _checkpoint_entry.size
+        name_unpack = _checkpoint_name.unpack_from
+        name_size = _checkpoint_name.size
+
+        offset = _checkpoint_header.size
+        for _ in range(count):
+            inode, mtime_ns, path_len, entry_count = dir_unpack(data, offset)
+            offset += dir_size
+            path = data[offset:offset + path_len]
+            offset += path_len
+
+            if want_stats:
+                entries = {}
+                for _ in range(entry_count):
+                    ino, size, entry_mtime_ns, is_dir, name_len = entry_unpack(data, offset)
+                    offset += entry_size
+                    entries[data[offset:offset + name_len]] = (ino, size, entry_mtime_ns, bool(is_dir))
+                    offset += name_len
+            else:
+                entries = []
+                for _ in range(entry_count):
+                    name_len, = name_unpack(data, offset)
+                    offset += name_size
+                    entries.append(data[offset:offset + name_len])
+                    offset += name_len
+
+            dirs[path] = (inode, mtime_ns, entries)
+    except _struct.error:
+        # truncated
+        return None
+    finally:
+        data.close()
+
+    return dirs
+
+class RecursiveInotify(Inotify):
+    """Watch whole directory trees, adding and removing watches as directories
+    are created, moved and deleted
+
+    Events are returned as InotifyPathEvents which carry the full path of the
+    file/dir the event occurred against. When a new directory appears its
+    contents are crawled and watched and a synthetic IN_CREATE event is
+    generated for every entry found so files created before the watch was
+    armed are not missed (these may duplicate real events for entries
+    created while the crawl was in progress)
+
+    The wd -> path and path -> wd index is kept incrementally: new
+    directories are attached from IN_CREATE/IN_MOVED_TO events and subtrees
+    are dropped on IN_DELETE_SELF/IN_MOVED_FROM without rescanning the tree.
+    Paths are always bytes
+
+    If snapshot is set the inode, size and mtime of every entry in the tree
+    is cached (at the cost of a stat per entry during the crawl and per
+    event afterwards). When the kernel queue overflows (IN_Q_OVERFLOW) the
+    tree is rescanned and diffed against the snapshot and synthetic
+    IN_CREATE/IN_MODIFY/IN_DELETE events are returned after the overflow
+    event so consumers stay consistent without restarting the watcher
+
+    include/exclude take glob patterns as for PathFilter, directories that
+    are excluded are never watched or crawled and events for filtered out
+    files are dropped while the raw buffer is parsed
+
+    If max_watches is set no more than that many watches are held (see
+    get_watch_limits() to size it). When a new directory needs a watch and
+    the budget is used up the least recently active subtree is evicted, a
+    subtree that can not be watched at all (including when the kernel
+    limit is hit) falls back to polling. Polled subtrees are checked every
+    poll_interval seconds by comparing directory mtimes, this happens on
+    read or by calling poll_evicted(), and produce IN_CREATE/IN_DELETE
+    events with a wd of -1 (changes to file contents are not seen). A
+    polled subtree that changes is watched again once there is room
+
+    owns splits a tree between several watchers (see ShardedInotify), it
+    is called with the path of every entry directly inside a watched root
+    and entries it returns False for are neither watched nor reported.
+    Everything below an owned directory is owned as well. Events against
+    the root itself are reported by every watcher
+
+    save_checkpoint() writes the index (and snapshot) to disk, passing the
+    file to watch() on the next start re-arms the watches from it and only
+    lists the directories whose mtime has changed instead of crawling the
+    whole tree
+    """
+    def __init__(self, mask=IN_ALL_EVENTS, flags=0, closefd=_CLOEXEC_DEFAULT, buffer_size=READ_BUFFER_SIZE,
+                 snapshot=False, include=None, exclude=None, max_watches=None, poll_interval=5.0,
+                 stats=False, stats_hook=None, owns=None):
+        """Create a new RecursiveInotify object
+
+        Arguments
+        ----------
+        :param int mask: The IN_* events to report for every directory in the tree
+        :param int flags: Flags to pass to inotify_init (IN_NONBLOCK, IN_CLOEXEC)
+        :param bool snapshot: Keep a snapshot of the tree to recover from queue overflows
+        :param list include: Only report events for files matching these glob patterns
+        :param list exclude: Never watch or report events for files/dirs matching these glob patterns
+        :param int max_watches: Maximum number of watches to hold, None for no limit
+        :param float poll_interval: Seconds between polls of subtrees that could not be watched
+        :param bool stats: Keep counters of the events read, see Inotify.stats()
+        :param callable stats_hook: Called with a ReadStats after every read (implies stats)
+        :param callable owns: Called as owns(path, is_dir) for the entries of the roots, only owned entries are watched
+        """
+        super(RecursiveInotify, self).__init__(flags, closefd=closefd, buffer_size=buffer_size,
+                                               stats=stats, stats_hook=stats_hook)
+
+        self._mask = mask
+        self._watch_mask = mask | _TREE_EVENTS | IN_ONLYDIR | IN_DONT_FOLLOW
+        if snapshot:
+            self._watch_mask |= _SNAPSHOT_EVENTS
+        self._deliver_mask = (mask & (IN_ALL_EVENTS | IN_IGNORED)) | _ALWAYS_DELIVERED
+
+        self._paths = {} # wd -> path
+        self._wds = {} # path -> wd
+        self._children = {} # wd -> set of child wd's, only present for dirs with watched subdirs
+        self._roots = set()
+        self._snapshot = {} if snapshot else None # wd -> {filename: snapshot entry}
+
+        # the same filter applies to every directory in the tree
+        if include or exclude:
+            self._path_filter = PathFilter(include, exclude)
+            self._event_filter = self._path_filter.event_filter
+        else:
+            self._path_filter = None
+
+        self._owns = owns
+        if owns is not None:
+            self._event_filter = self._filter_owned
+
+        self._max_watches = max_watches
+        # wd -> None ordered from least to most recently active, only kept when there is a budget
+        self._activity = _OrderedDict() if max_watches is not None else None
+        self._polled = {} # subtree root -> {dir path: (mtime, {filename: is_dir})}
+        self._poll_interval = poll_interval
+        self._next_poll = 0
+
+        self.evictions = 0
+        self.last_crawl = None
+        self.last_restore = None
+
+    def watch(self, path, workers=CRAWL_WORKERS, progress=None, progress_interval=1.0, checkpoint=None):
+        """Recursively watch the directory at path and everything below it
+
+        The tree is crawled by a pool of worker threads, directories created
+        while the crawl is in progress are picked up either by the crawl or
+        by the events they generate so nothing is missed. The result of the
+        crawl is available as the last_crawl attribute
+
+        If checkpoint names a file written by save_checkpoint() that covers
+        path the tree is restored from it instead of crawled: every
+        directory is watched again but only those whose inode or mtime
+        differs from the checkpoint are listed. With a snapshot the changes
+        found are returned as synthetic events by the next read (files
+        modified in place in an unchanged directory are not noticed). The
+        result is available as the last_restore attribute, a missing or
+        unusable checkpoint falls back to a crawl
+
+        Arguments
+        ----------
+        :param str path: The directory to watch
+        :param int workers: Number of threads to crawl the tree with (<= 1 crawls in the calling thread)
+        :param callable progress: Called with a CrawlProgress every progress_interval seconds and on completion
+        :param float progress_interval: Seconds between calls to progress
+        :param str checkpoint: A file written by save_checkpoint() to restore the tree from
+
+        Returns
+        --------
+        :return: The watch descriptor of the top level directory
+        :rtype: int
+
+        Exceptions
+        -----------
+        :raises ValueError: path does not exist or is not a directory
+        :raises PermissionError: path is not readable
+        :raises OSError: Maximum number of watches hit
+        """
+        if isinstance(path, str):
+            path = _os.fsencode(path)
+        path = _os.path.abspath(path)
+
+        # watch the root first so errors are raised rather than skipped
+        wd = self._add_dir(path)
+        self._roots.add(wd)
+
+        saved = None
+        if checkpoint is not None:
+            saved = _load_checkpoint(checkpoint, self._snapshot is not None)
+
+        if saved is not None and path in saved:
+            self._events.extend(self._restore(path, wd, saved))
+            if progress is not None:
+                progress(self.last_crawl)
+        else:
+            self._crawl(path, wd, workers, progress, progress_interval)
+
+        return wd
+
+    def save_checkpoint(self, filename):
+        """Write the index (and snapshot) to filename so a later watch() can
+        restore from it rather than crawl
+
+        Events should be read up to date first, directories modified in
+        the last couple of seconds are marked so they are always listed
+        on restore. The file is written to a temporary name and renamed
+        into place
+
+        Arguments
+        ----------
+        :param str filename: The file to write
+
+        Returns
+        --------
+        :return: The number of directories saved
+        :rtype: int
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            # only the tree structure is needed, polled subtrees included
+            subdirs = {}
+            for path in list(self._wds) + list(self._polled):
+                parent, name = _os.path.split(path)
+                subdirs.setdefault(parent, []).append(name)
+
+        flags = _CHECKPOINT_STATS if snapshot is not None else 0
+        data = bytearray(_checkpoint_header.size)
+        dir_pack = _checkpoint_dir.pack
+        entry_pack = _checkpoint_entry.pack
+        name_pack = _checkpoint_name.pack
+        recent = int(_time() * 10**9) - _CHECKPOINT_GRACE
+
+        count = 0
+        # sorted so parents come before their children
+        for path, wd in sorted(self._wds.items()):
+            try:
+                stat = _os.lstat(path)
+            except OSError:
+                # gone, the events saying so have not been read yet
+                continue
+
+            mtime_ns = stat.st_mtime_ns
+            if mtime_ns >= recent:
+                mtime_ns = -1
+
+            if snapshot is not None:
+                entries = snapshot.get(wd, {})
+                data += dir_pack(stat.st_ino, mtime_ns, len(path), len(entries))
+                data += path
+                for name, (ino, size, entry_mtime_ns, is_dir) in entries.items():
+                    data += entry_pack(ino, size, entry_mtime_ns, is_dir, len(name))
+                    data += name
+            else:
+                names = subdirs.get(path, ())
+                data += dir_pack(stat.st_ino, mtime_ns, len(path), len(names))
+                data += path
+                for name in names:
+                    data += name_pack(len(name))
+                    data += name
+            count += 1
+
+        _checkpoint_header.pack_into(data, 0, _CHECKPOINT_MAGIC, _CHECKPOINT_VERSION, flags, count)
+
+        tmp = _os.fsencode(filename) + b'.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        _os.replace(tmp, filename)
+
+        return count
+
+    def _restore(self, root, root_wd, saved):
+        """Watch every directory below root (already watched as root_wd) from
+        a checkpoint, directories that changed since it was saved are
+        listed (and diffed against the saved snapshot) and new ones crawled
+
+        Returns the synthetic events for the changes found
+        """
         fd = self.fileno()
-        
-        # The following code is complex but required to get the same values with
-        # expected behavior with blocking/non-blocking fd's
-        # blockers will block, non-blockers will return []
-        buf_len = _get_buffered_length(fd)
-        if buf_len == 0:
+        mask = self._watch_mask
+        snapshot = self._snapshot
+        join = _os.path.join
+        start = _time()
+        count = rescanned = 0
+
+        events = []
+        stack = [(root, root_wd)]
+        while stack:
+            path, wd = stack.pop()
+            if wd is None:
+                if not self._make_room(path):
+                    self._start_polling(path, baseline=True)
+                    continue
+                try:
+                    wd = inotify_add_watch(fd, path, mask)
+                except (ValueError, _PermissionError):
+                    # removed, replaced by a non-directory or unreadable
+                    continue
+                except OSError as err:
+                    if err.errno != _ENOSPC:
+                        raise
+                    self._start_polling(path, baseline=True)
+                    continue
+                self._index_dir(path, wd, recent=False)
+            count += 1
+
+            # the watch is armed before the directory is looked at so
+            # nothing changed after this point is missed
+            try:
+                stat = _os.lstat(path)
+            except OSError:
+                # gone again, the parent's events report it
+                continue
+
+            record = saved.get(path)
+            if record is not None and record[0] == stat.st_ino and record[1] == stat.st_mtime_ns:
+                if snapshot is not None:
+                    snapshot[wd] = record[2]
+                    names = [name for name, entry in record[2].items() if entry[3]]
+                else:
+                    names = record[2]
+            else:
+                rescanned += 1
+                if snapshot is not None:
+                    snapshot[wd] = record[2] if record is not None else {}
+                    # new subdirectories are crawled by the rescan
+                    events.extend(self._rescan_dir(wd, path))
+                    names = [name for name, entry in snapshot[wd].items() if entry[3]]
+                else:
+                    _, _, subdirs, _ = _scan_dir(fd, mask, path, wd, path_filter=self._path_filter,
+                                                 owns=self._owns if wd in self._roots else None)
+                    names = [_os.path.basename(subdir) for subdir in subdirs]
+
+            for name in names:
+                subdir = join(path, name)
+                if subdir not in self._wds:
+                    stack.append((subdir, None))
+
+        elapsed = _time() - start
+        self.last_crawl = CrawlProgress(count, elapsed, True)
+        self.last_restore = CheckpointRestore(count, rescanned, elapsed)
+
+        return events
+
+    def ignore(self, wd):
+        """Stop watching the directory identified by wd and everything below it"""
+        self._drop_tree(wd, rm_watch=True)
+
+    def get_path(self, wd):
+        """Return the path of the directory being watched by wd (None if not watched)"""
+        return self._paths.get(wd)
+
+    def get_wd(self, path):
+        """Return the watch descriptor watching the directory at path (None if not watched)"""
+        if isinstance(path, str):
+            path = _os.fsencode(path)
+        return self._wds.get(path)
+
+    def get_entry(self, path):
+        """Return the snapshot (inode, size, mtime_ns, is_dir) of the entry at
+        path, None if it is not in a watched directory's snapshot"""
+        assert self._snapshot is not None, "get_entry requires snapshot=True"
+
+        if isinstance(path, str):
+            path = _os.fsencode(path)
+        dirpath, name = _os.path.split(path)
+        wd = self._wds.get(dirpath)
+        if wd is None:
+            return None
+        return self._snapshot.get(wd, {}).get(name)
+
+    def entries(self):
+        """Iterate over (path, (inode, size, mtime_ns, is_dir)) for every entry in the snapshot"""
+        assert self._snapshot is not None, "entries requires snapshot=True"
+
+        join = _os.path.join
+        for wd, entries in list(self._snapshot.items()):
+            dirpath = self._paths.get(wd)
+            if dirpath is None:
+                continue
+            for name, entry in entries.items():
+                yield join(dirpath, name), entry
+
+    @property
+    def watch_count(self):
+        """The number of directories currently being watched"""
+        return len(self._paths)
+
+    @property
+    def polled(self):
+        """The roots of the subtrees being polled rather than watched"""
+        return list(self._polled)
+
+    def _add_dir(self, path):
+        if not self._make_room(path):
+            raise OSError(_ENOSPC, "Watch budget exhausted and no watches can be evicted")
+        wd = inotify_add_watch(self.fileno(), path, self._watch_mask)
+        self._index_dir(path, wd)
+
+        return wd
+
+    def _index_dir(self, path, wd, recent=True):
+        old_path = self._paths.get(wd)
+        if old_path is not None and old_path != path:
+            # the same directory is now reachable via a new path (eg a move
+            # we have not seen the events for yet), re-index it from scratch
+            self._drop_tree(wd, rm_watch=False)
+
+        self._paths[wd] = path
+        self._wds[path] = wd
+        if self._activity is not None:
+            self._activity[wd] = None
+            self._activity.move_to_end(wd, last=recent)
+
+        parent = self._wds.get(_os.path.dirname(path))
+        if parent is not None and parent != wd:
+            self._children.setdefault(parent, set()).add(wd)
+
+    def _filter_owned(self, wd, mask, filename):
+        if self._path_filter is not None and not self._path_filter.event_filter(wd, mask, filename):
+            return False
+        if not filename or wd not in self._roots:
+            # only the entries of a root are split, everything below them is owned
+            return True
+        return self._owns(_os.path.join(self._paths[wd], filename), mask & IN_ISDIR)
+
+    def _crawl(self, root, root_wd, workers, progress, progress_interval):
+        """Watch every directory below root (already watched as root_wd) using
+        a bounded pool of worker threads, the index is only updated from
+        this thread"""
+        fd = self.fileno()
+        mask = self._watch_mask
+        path_filter = self._path_filter
+        owns = self._owns
+        snapshot = self._snapshot
+        want_stats = snapshot is not None
+        start = last_report = _time()
+        count = 0
+
+        # nothing has any activity yet so nothing is evicted during a crawl,
+        # directories beyond the budget are polled instead
+        quota = None
+        if self._max_watches is not None:
+            quota = _Quota(self._max_watches - len(self._paths))
+
+        if workers > 1:
+            from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+            pool = ThreadPoolExecutor(workers)
+        else:
+            pool = None
+
+        # bound the amount of queued work so memory use does not depend on the tree size
+        max_running = max(workers, 1) * 2
+        pending = _deque([[(root, root_wd)]])
+        running = set()
+        try:
+            while pending or running:
+                if pool is None:
+                    done = [_scan_tree(fd, mask, pending.pop(), _CRAWL_BATCH, want_stats, path_filter,
+                                       quota, owns)]
+                else:
+                    while pending and len(running) < max_running:
+                        running.add(pool.submit(_scan_tree, fd, mask, pending.pop(), _CRAWL_BATCH, want_stats,
+                                                 path_filter, quota, owns))
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    done = [future.result() for future in done]
+
+                for results, remaining in done:
+                    for path, wd, _, entries in results:
+                        if wd is None:
+                            continue
+                        if wd is _NO_SPACE:
+                            self._start_polling(path, baseline=True)
+                            continue
+                        # parents are always indexed before their children
+                        self._index_dir(path, wd, recent=False)
+                        if want_stats:
+                            snapshot[wd] = dict((entry[0], entry[3]) for entry in entries)
+                        count += 1
+
+                    # split the unscanned work so idle workers can pick it up
+                    if remaining:
+                        half = len(remaining) // 2
+                        if half and pool is not None:
+                            pending.append(remaining[:half])
+                            remaining = remaining[half:]
+                        pending.append(remaining)
+
+                if progress is not None and _time() - last_report >= progress_interval:
+                    last_report = _time()
+                    progress(CrawlProgress(count, last_report - start, False))
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+        self.last_crawl = CrawlProgress(count, _time() - start, True)
+        if progress is not None:
+            progress(self.last_crawl)
+
+    def _add_tree(self, root, synthetic=True):
+        """Watch a newly created directory and everything below it
+
+        Returns a synthetic IN_CREATE event for every entry found (if synthetic is set)
+        """
+        synthetic = synthetic and self._mask & IN_CREATE
+        snapshot = self._snapshot
+        want_stats = snapshot is not None
+        fd = self.fileno()
+        mask = self._watch_mask
+        events = []
+
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            if self._make_room(path):
+                path, wd, subdirs, entries = _scan_dir(fd, mask, path, want_entries=synthetic or want_stats,
+                                                       want_stats=want_stats, path_filter=self._path_filter)
+            else:
+                wd = _NO_SPACE
+
+            if wd is None:
+                continue
+            if wd is _NO_SPACE:
+                # with an empty baseline the first poll reports everything in it as created
+                self._start_polling(path, baseline=not synthetic)
+                continue
+
+            self._index_dir(path, wd)
+            stack.extend(subdirs)
+
+            if want_stats:
+                snapshot[wd] = dict((entry[0], entry[3]) for entry in entries)
+
+            if synthetic:
+                for name, entry_path, is_dir, _ in entries:
+                    event_mask = IN_CREATE | IN_ISDIR if is_dir else IN_CREATE
+                    events.append(InotifyPathEvent(wd, event_mask, 0, name, entry_path))
+
+        return events
+
+    def _drop_tree(self, wd, rm_watch):
+        """Remove wd and everything below it from the index, removing the
+        kernel watches as well if rm_watch is set"""
+        path = self._paths.get(wd)
+        if path is None:
+            return
+
+        if self._polled:
+            self._stop_polling(path)
+
+        parent = self._wds.get(_os.path.dirname(path))
+        siblings = self._children.get(parent)
+        if siblings is not None:
+            siblings.discard(wd)
+            if not siblings:
+                del self._children[parent]
+
+        stack = [wd]
+        while stack:
+            wd = stack.pop()
+            path = self._paths.pop(wd, None)
+            if path is None:
+                continue
+
+            if self._wds.get(path) == wd:
+                del self._wds[path]
+            if self._snapshot is not None:
+                self._snapshot.pop(wd, None)
+            if self._activity is not None:
+                self._activity.pop(wd, None)
+            self._roots.discard(wd)
+            stack.extend(self._children.pop(wd, ()))
+
+            if rm_watch:
+                try:
+                    inotify_rm_watch(self.fileno(), wd)
+                except ValueError:
+                    # already removed by the kernel
+                    pass
+
+    def _make_room(self, path):
+        """Evict the least recently active subtrees until there is room in the
+        budget for a watch on path, returns False if nothing can be evicted"""
+        if self._max_watches is None:
+            return True
+
+        while len(self._paths) >= self._max_watches:
+            for victim in self._activity:
+                # evicting a root or an ancestor of path would take path with it
+                victim_path = self._paths[victim]
+                if victim not in self._roots and not path.startswith(victim_path + b'/'):
+                    break
+            else:
+                return False
+
+            self._drop_tree(victim, rm_watch=True)
+            self._start_polling(victim_path, baseline=True)
+            self.evictions += 1
+
+        return True
+
+    def _start_polling(self, root, baseline):
+        """Poll the subtree at root instead of watching it, if baseline is
+        set its current state is recorded so only later changes are reported"""
+        state = {}
+        if baseline:
+            self._poll_tree(root, state)
+        self._polled[root] = state
+
+    def _stop_polling(self, path):
+        """Stop polling any subtree at or below path"""
+        prefix = path + b'/'
+        for root in list(self._polled):
+            if root == path or root.startswith(prefix):
+                del self._polled[root]
+
+    def _has_room(self, count):
+        return self._max_watches is None or len(self._paths) + count <= self._max_watches
+
+    def poll_evicted(self):
+        """Check the subtrees that are being polled rather than watched for
+        changes, a subtree that has changed is watched again if the budget
+        has room for it
+
+        Returns
+        --------
+        :return: Synthetic IN_CREATE/IN_DELETE events for every difference found
+        :rtype: list of InotifyPathEvent
+        """
+        self._next_poll = _monotonic() + self._poll_interval
+
+        events = []
+        for root, state in list(self._polled.items()):
+            if self._polled.get(root) is not state:
+                # dropped while handling an earlier subtree
+                continue
+
+            changes = self._poll_tree(root, state)
+            if changes is None:
+                # removed, the watched parent reports that
+                del self._polled[root]
+                continue
+
+            events.extend(changes)
+            if changes and self._has_room(len(state)):
+                del self._polled[root]
+                self._add_tree(root, synthetic=False)
+
+        return events
+
+    def _poll_tree(self, root, state):
+        """Diff the directories below root against state (updating it), only
+        directories whose mtime changed are listed again
+
+        Returns the synthetic events or None if root no longer exists
+        """
+        mask = self._mask
+        path_filter = self._path_filter
+        join = _os.path.join
+
+        events = []
+        seen = set()
+        stack = [root]
+        while stack:
+            path = stack.pop()
             try:
-                _os.read(fd, 0)
-            except OSError as err:
-                # eat the OS error as the ammount of bytes in the buffer may have increased from 0
-                # between the _get_buffered_length and here, we eat the exception and try again
-                # so the caller does not ahve to deal with it. if there is a greater issue
-                # the second read should blow up
-                if err.errno != _EINVAL:
-                    raise
-                pass
-            buf_len = _get_buffered_length(fd)
-        raw_events = _os.read(fd, buf_len)
-
-        events = str_to_events(raw_events)
+                mtime = _os.lstat(path).st_mtime_ns
+            except OSError:
+                if path == root:
+                    return None
+                continue
+
+            seen.add(path)
+            old_mtime, old_names = state.get(path, (None, {}))
+            if mtime == old_mtime:
+                names = old_names
+            else:
+                names = {}
+                try:
+                    listing = list(_os.scandir(path))
+                except OSError:
+                    listing = ()
+                for entry in listing:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if path_filter is None or path_filter(entry.name, is_dir):
+                        names[entry.name] = is_dir
+                state[path] = (mtime, names)
+
+                for name, is_dir in old_names.items():
+                    if names.get(name) != is_dir and mask & IN_DELETE:
+                        event_mask = IN_DELETE | IN_ISDIR if is_dir else IN_DELETE
+                        events.append(InotifyPathEvent(-1, event_mask, 0, name, join(path, name)))
+                for name, is_dir in names.items():
+                    if old_names.get(name) != is_dir and mask & IN_CREATE:
+                        event_mask = IN_CREATE | IN_ISDIR if is_dir else IN_CREATE
+                        events.append(InotifyPathEvent(-1, event_mask, 0, name, join(path, name)))
+
+            stack.extend(join(path, name) for name, is_dir in names.items() if is_dir)
+
+        # forget directories that have gone
+        for path in list(state):
+            if path not in seen:
+                del state[path]
 
         return events
 
+    def _update_snapshot(self, wd, mask, filename, path):
+        entries = self._snapshot.setdefault(wd, {})
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            entries.pop(filename, None)
+        elif mask & _SNAPSHOT_UPDATE:
+            try:
+                entries[filename] = _snapshot_entry(_os.lstat(path), bool(mask & IN_ISDIR))
+            except OSError:
+                # already gone again, the IN_DELETE will follow
+                entries.pop(filename, None)
+
+    def rescan(self):
+        """Diff every watched directory against the snapshot
+
+        Only the directories already in the index are listed (new
+        directories found are crawled), the snapshot is updated to match
+        what was found. This is called automatically when the kernel queue
+        overflows
+
+        Returns
+        --------
+        :return: Synthetic IN_CREATE/IN_MODIFY/IN_DELETE events for every difference found
+        :rtype: list of InotifyPathEvent
+        """
+        assert self._snapshot is not None, "rescan requires snapshot=True"
+
+        events = []
+        for wd, path in list(self._paths.items()):
+            # may have been dropped as part of a deleted/replaced parent
+            if self._paths.get(wd) == path:
+                events.extend(self._rescan_dir(wd, path))
+
+        return events
+
+    def _rescan_dir(self, wd, path):
+        fd = self.fileno()
+        mask = self._mask
+        old = self._snapshot.get(wd, {})
+
+        _, _, _, entries = _scan_dir(fd, self._watch_mask, path, wd, want_entries=True, want_stats=True,
+                                     path_filter=self._path_filter,
+                                     owns=self._owns if wd in self._roots else None)
+        new = self._snapshot[wd] = dict((entry[0], entry[3]) for entry in entries)
+
+        events = []
+        for name, entry_path, is_dir, entry in entries:
+            old_entry = old.get(name)
+            if old_entry is not None and old_entry[0] == entry[0] and old_entry[3] == is_dir:
+                if old_entry != entry and mask & IN_MODIFY:
+                    event_mask = IN_MODIFY | IN_ISDIR if is_dir else IN_MODIFY
+                    events.append(InotifyPathEvent(wd, event_mask, 0, name, entry_path))
+                continue
+
+            if old_entry is not None:
+                # replaced by a different file/dir
+                events.extend(self._rescan_deleted(wd, path, name, old_entry))
+
+            if mask & IN_CREATE:
+                event_mask = IN_CREATE | IN_ISDIR if is_dir else IN_CREATE
+                events.append(InotifyPathEvent(wd, event_mask, 0, name, entry_path))
+            if is_dir:
+                events.extend(self._add_tree(entry_path))
+
+        for name, old_entry in old.items():
+            if name not in new:
+                events.extend(self._rescan_deleted(wd, path, name, old_entry))
+
+        return events
+
+    def _rescan_deleted(self, wd, path, name, old_entry):
+        entry_path = _os.path.join(path, name)
+        is_dir = old_entry[3]
+        if is_dir:
+            child = self._wds.get(entry_path)
+            if child is not None:
+                self._drop_tree(child, rm_watch=True)
+
+        if self._mask & IN_DELETE:
+            event_mask = IN_DELETE | IN_ISDIR if is_dir else IN_DELETE
+            return [InotifyPathEvent(wd, event_mask, 0, name, entry_path)]
+        return []
+
+    def read_batch(self):
+        # every event has to be looked at to keep the index up to date and
+        # converted to carry its full path so there is nothing to gain
+        raise NotImplementedError("RecursiveInotify does not support batches, use read_events()")
+
+    def _read_events(self):
+        events = super(RecursiveInotify, self)._read_events()
+        events = self._process_events(events)
+
+        if self._polled and _monotonic() >= self._next_poll:
+            events.extend(self.poll_evicted())
+
+        return events
+
+    def _process_events(self, events):
+        """Update the index from a batch of raw events and convert them to InotifyPathEvents"""
+        paths = self._paths
+        deliver_mask = self._deliver_mask
+        snapshot = self._snapshot
+        activity = self._activity
+        join = _os.path.join
+
+        processed = []
+        append = processed.append
+        for wd, mask, cookie, filename in events:
+            dirpath = paths.get(wd)
+            if dirpath is None:
+                # overflow events have a wd of -1, anything else is a
+                # straggler for a watch that has already been dropped
+                if mask & _ALWAYS_DELIVERED:
+                    append(InotifyPathEvent(wd, mask, cookie, filename, None))
+                if mask & IN_Q_OVERFLOW and snapshot is not None:
+                    processed.extend(self.rescan())
+                continue
+
+            path = join(dirpath, filename) if filename else dirpath
+
+            if activity is not None:
+                activity.move_to_end(wd)
+
+            if mask & deliver_mask:
+                append(InotifyPathEvent(wd, mask, cookie, filename, path))
+
+            if snapshot is not None and filename:
+                self._update_snapshot(wd, mask, filename, path)
+
+            if mask & IN_ISDIR and filename:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    processed.extend(self._add_tree(path))
+                elif mask & IN_MOVED_FROM:
+                    child = self._wds.get(path)
+                    if child is not None:
+                        self._drop_tree(child, rm_watch=True)
+                    elif self._polled:
+                        self._stop_polling(path)
+
+            if mask & (IN_DELETE_SELF | IN_IGNORED):
+                self._drop_tree(wd, rm_watch=False)
+            elif mask & IN_MOVE_SELF and wd in self._roots:
+                # our paths for the whole tree are now wrong
+                self._drop_tree(wd, rm_watch=True)
+
+        return processed
+
+
+class ShardOwner(object):
+    """owns callable for RecursiveInotify that takes the entries whose path
+    hashes to index out of count shards
+
+    crc32 is used rather than hash() so the split is the same in every
+    process (hash() of bytes is randomised per process), which lets each
+    shard be run in its own process:
+
+    >>> def worker(index, count, path):
+    ...     inotify = RecursiveInotify(owns=ShardOwner(index, count))
+    ...     inotify.watch(path)
+    ...     for event in inotify: ...
+    """
+    __slots__ = ['index', 'count']
+
+    def __init__(self, index, count):
+        assert 0 <= index < count, "index must be less than count"
+        self.index = index
+        self.count = count
+
+    def __call__(self, path, is_dir=False):
+        return _crc32(path) % self.count == self.index
+
+    def __repr__(self):
+        return "<{} {}/{}>".format(self.__class__.__name__, self.index, self.count)
+
+
+class ShardedInotify(object):
+    """Spread a tree over several RecursiveInotify instances (shards) so
+    events can be read and processed in parallel
+
+    Each entry directly inside a watched directory, and the whole subtree
+    below it, belongs to the shard chosen by a stable hash of its path (see
+    ShardOwner). Each shard has its own fd and can be read from its own
+    thread, start() runs a reader thread per shard that either hands
+    batches to a handler in that thread or merges them into a single
+    queue read with read_events(). Every path belongs to exactly one shard
+    and each shard's batches are queued in order so events for any one path
+    keep their order, events for different paths may be interleaved
+    differently to the order the kernel saw them (eg the two halves of a
+    rename between subtrees in different shards). Events against the
+    watched directory itself are reported by every shard
+
+    >>> sharded = ShardedInotify(8, IN_CLOSE_WRITE)
+    >>> sharded.watch('/srv/build')
+    >>> sharded.start(lambda shard, events: rebuild(events))
+    """
+    def __init__(self, shards=4, mask=IN_ALL_EVENTS, flags=0, **kwargs):
+        """Arguments
+        ----------
+        :param int shards: Number of RecursiveInotify instances to split the tree over
+        :param int mask: The IN_* events to report for every directory in the tree
+        :param int flags: Flags to pass to inotify_init (IN_NONBLOCK, IN_CLOEXEC)
+        :param kwargs: Passed on to every RecursiveInotify (snapshot, include, exclude...)
+        """
+        self.shards = [RecursiveInotify(mask, flags, owns=ShardOwner(i, shards), **kwargs) for i in range(shards)]
+
+        self._threads = []
+        self._queue = None
+        self._stop_r = self._stop_w = None
+
+    def shard_for(self, path):
+        """Return the shard responsible for the entry at path directly inside a watched directory"""
+        if isinstance(path, str):
+            path = _os.fsencode(path)
+        return self.shards[_crc32(path) % len(self.shards)]
+
+    def watch(self, path, workers=CRAWL_WORKERS):
+        """Recursively watch the directory at path in every shard
+
+        Returns
+        --------
+        :return: The watch descriptor of path in each shard
+        :rtype: list of int
+        """
+        workers = max(workers // len(self.shards), 1)
+        return [shard.watch(path, workers=workers) for shard in self.shards]
+
+    def start(self, handler=None, maxsize=0):
+        """Start a reader thread per shard
+
+        Arguments
+        ----------
+        :param callable handler: Called as handler(shard, events) in the shard's thread for every batch,
+                                 if None batches are merged into a queue read with read_events()
+        :param int maxsize: Maximum number of batches held in the merged queue before readers block
+        """
+        assert not self._threads, "already started"
+        from queue import Queue
+
+        self._queue = Queue(maxsize) if handler is None else None
+        self._stop_r, self._stop_w = _os.pipe()
+        for i, shard in enumerate(self.shards):
+            thread = _Thread(target=self._reader, args=(shard, handler), name="inotify shard {}".format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _reader(self, shard, handler):
+        stop = self._stop_r
+        while True:
+            ready, _, _ = _select([shard, stop], [], [])
+            if stop in ready:
+                return
+
+            try:
+                events = shard.read_events()
+            except BlockingIOError:
+                continue
+
+            if handler is not None:
+                handler(shard, events)
+            else:
+                self._queue.put(events)
+
+    def read_events(self, timeout=None):
+        """Return the next batch of events from the merged queue (requires start() without a handler)
+
+        Arguments
+        ----------
+        :param float timeout: Maximum seconds to wait for events, None to wait forever
+
+        Returns
+        --------
+        :return: A batch of events from a single shard, empty if the timeout expired
+        :rtype: list of InotifyPathEvent
+        """
+        assert self._queue is not None, "start() must be called without a handler to merge events"
+        from queue import Empty
+
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            return []
+
+    def stop(self):
+        """Stop the reader threads, events not yet read stay queued in the kernel"""
+        if not self._threads:
+            return
+
+        _os.write(self._stop_w, b'x')
+        for thread in self._threads:
+            thread.join()
+        _os.close(self._stop_r)
+        _os.close(self._stop_w)
+
+        self._threads = []
+        self._stop_r = self._stop_w = None
+
+    def close(self):
+        self.stop()
+        for shard in self.shards:
+            shard.close()
+
+    @property
+    def watch_count(self):
+        """The number of directories being watched by all the shards"""
+        return sum(shard.watch_count for shard in self.shards)
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __iter__(self):
+        while True:
+            for event in self.read_events():
+                yield event
+
+    def __repr__(self):
+        return "<{} shards={} watches={}>".format(self.__class__.__name__, len(self.shards), self.watch_count)
+
+
+Rename = _namedtuple("Rename", "src dst")
+
+class MovePairer(object):
+    """Pair up the IN_MOVED_FROM/IN_MOVED_TO halves of a rename by their cookie
+
+    Works on top of any Inotify (including RecursiveInotify) and returns a
+    single Rename(src, dst) holding both original events in place of the
+    IN_MOVED_TO half. A IN_MOVED_FROM is held for up to window seconds
+    waiting for its partner (the kernel queues both halves back to back but
+    they can be split across reads), if none arrives the file was moved out
+    of the watched area and it is returned as an IN_DELETE. An IN_MOVED_TO
+    without a partner was moved in from outside and is returned as an
+    IN_CREATE straight away
+
+    Events that do not need pairing are passed through unchanged, a held
+    IN_MOVED_FROM may therefore be returned after events that followed it
+    """
+    def __init__(self, inotify, window=0.05):
+        """Arguments
+        ----------
+        :param Inotify inotify: The object to read events from
+        :param float window: Seconds to wait for the IN_MOVED_TO half of a rename
+        """
+        self._inotify = inotify
+        self._window = window
+        self._pending = _OrderedDict() # cookie -> (expiry time, IN_MOVED_FROM event)
+
+        self.renames = 0
+        self.unmatched = 0
+
+    def fileno(self):
+        return self._inotify.fileno()
+
+    def read_events(self, timeout=None):
+        """Read a batch of events, pairing renames
+
+        Blocks until events are available, timeout expires or a held
+        IN_MOVED_FROM expires
+
+        Arguments
+        ----------
+        :param float timeout: Maximum seconds to wait for events, None to wait forever
+
+        Returns
+        --------
+        :return: InotifyEvents and Renames, empty if the timeout expired
+        :rtype: list
+        """
+        wait = timeout
+        if self._pending:
+            next_expiry = next(iter(self._pending.values()))[0]
+            until_expiry = max(next_expiry - _monotonic(), 0)
+            wait = until_expiry if wait is None else min(wait, until_expiry)
+
+        # events may already be cached on the object which select can not see
+        if not self._inotify._events:
+            ready, _, _ = _select([self._inotify], [], [], wait)
+            if not ready:
+                return self.flush()
+
+        return self.process(self._inotify.read_events())
+
+    def process(self, events):
+        """Pair renames in an already read batch of events and flush any
+        expired IN_MOVED_FROM halves"""
+        pending = self._pending
+        expires = _monotonic() + self._window
+
+        processed = []
+        append = processed.append
+        for event in events:
+            mask = event.mask
+            if mask & IN_MOVED_FROM:
+                pending[event.cookie] = (expires, event)
+            elif mask & IN_MOVED_TO:
+                src = pending.pop(event.cookie, (None, None))[1]
+                if src is None:
+                    self.unmatched += 1
+                    append(event._replace(mask=(mask & ~IN_MOVED_TO) | IN_CREATE, cookie=0))
+                else:
+                    self.renames += 1
+                    append(Rename(src, event))
+            else:
+                append(event)
+
+        processed.extend(self.flush())
+
+        return processed
+
+    def flush(self, all=False):
+        """Return the IN_MOVED_FROM halves that have waited longer than the
+        window (or all of them) as IN_DELETE events"""
+        now = _monotonic()
+        pending = self._pending
+
+        flushed = []
+        while pending:
+            cookie, (expiry, event) = next(iter(pending.items()))
+            if expiry > now and not all:
+                break
+            del pending[cookie]
+            self.unmatched += 1
+            flushed.append(event._replace(mask=(event.mask & ~IN_MOVED_FROM) | IN_DELETE, cookie=0))
+
+        return flushed
+
+    def __iter__(self):
+        while True:
+            for event in self.read_events():
+                yield event
+
+    def __repr__(self):
+        return "<{} inotify={!r} pending={}>".format(self.__class__.__name__, self._inotify, len(self._pending))
+
+
+# Events that only say 'this file was touched' and are safe to merge
+COALESCE_EVENTS = IN_ACCESS | IN_MODIFY | IN_ATTRIB | IN_OPEN | IN_CLOSE_WRITE | IN_CLOSE_NOWRITE
+
+class Coalescer(object):
+    """Merge runs of events against the same (wd, filename) into a single
+    event with the masks OR'd together
+
+    Editors and compilers generate long runs of IN_OPEN, IN_MODIFY,
+    IN_CLOSE_WRITE and IN_ATTRIB against the same file, after coalescing
+    the amount of events returned is proportional to the number of files
+    touched rather than the number of syscalls made. The merged event keeps
+    the position of the first event in the run
+
+    Only the events in mask are merged, any other event (eg IN_CREATE,
+    IN_DELETE, IN_MOVED_FROM) is passed through unchanged and ends the run
+    for its file so ordering against it is preserved. Objects without a
+    mask (eg Renames from a MovePairer) are passed through untouched
+
+    The source may be an Inotify, RecursiveInotify or MovePairer. With a
+    window reads continue until window seconds after the first event (or
+    max_events have been read) so bursts split over several reads are
+    merged as well
+    """
+    def __init__(self, source, window=0, max_events=None, mask=COALESCE_EVENTS):
+        """Arguments
+        ----------
+        :param source: The object to read events from
+        :param float window: Seconds to keep reading for after the first event arrives
+        :param int max_events: Stop reading once this many (unmerged) events have been read
+        :param int mask: The IN_* events that are safe to merge
+        """
+        self._source = source
+        self._window = window
+        self._max_events = max_events
+        self._mask = mask
+
+        self.events_in = 0
+        self.merged = 0
+
+    def fileno(self):
+        return self._source.fileno()
+
+    def read_events(self, timeout=None):
+        """Read a batch of events and coalesce them
+
+        Arguments
+        ----------
+        :param float timeout: Maximum seconds to wait for the first event, None to wait forever
+
+        Returns
+        --------
+        :return: The coalesced events, empty if the timeout expired
+        :rtype: list
+        """
+        events = self._read(timeout)
+
+        if self._window and events:
+            deadline = _monotonic() + self._window
+            max_events = self._max_events
+            while max_events is None or len(events) < max_events:
+                remaining = deadline - _monotonic()
+                if remaining <= 0:
+                    break
+                events.extend(self._read(remaining))
+
+        return self.process(events)
+
+    def _read(self, timeout):
+        source = self._source
+        # events may already be cached on the object which select can not see
+        if not getattr(source, '_events', None):
+            ready, _, _ = _select([source], [], [], timeout)
+            if not ready:
+                return []
+
+        return list(source.read_events())
+
+    def process(self, events):
+        """Coalesce an already read batch of events"""
+        coalesce_mask = self._mask
+        runs = {} # (wd, filename) -> index of the merged event in processed
+
+        processed = []
+        append = processed.append
+        for event in events:
+            mask = getattr(event, 'mask', None)
+            if mask is None:
+                append(event)
+                continue
+
+            key = (event.wd, event.filename)
+            if mask & ~IN_ISDIR & ~coalesce_mask:
+                # not safe to merge across this event
+                runs.pop(key, None)
+                append(event)
+                continue
+
+            i = runs.get(key)
+            if i is None:
+                runs[key] = len(processed)
+                append(event)
+            else:
+                merged = processed[i]
+                processed[i] = merged._replace(mask=merged.mask | mask)
+
+        self.events_in += len(events)
+        self.merged += len(events) - len(processed)
+
+        return processed
+
+    def __iter__(self):
+        while True:
+            for event in self.read_events():
+                yield event
+
+    def __repr__(self):
+        return "<{} source={!r} merged={}>".format(self.__class__.__name__, self._source, self.merged)
+
+
 def watch(path, events=IN_ALL_EVENTS):
     """Quick Convience function to watch a file or dir for any changes
 
     If a dir argument is provided this call will not recursively watch the directories
     due to limitations in inotify's API. if you wish to watch directories recursively
-    you will need to recurs it yourself and add the watches manually
+    use a RecursiveInotify object instead
 
     Warning: if using this function to watch a file or dir repeatedly you may miss events
     due to a race condition, consider using the Inotify object instead to get all the 
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""poller: wait on many event like objects at once using a single epoll fd"""
+
+from select import epoll as _epoll
+from select import EPOLLIN, EPOLLET
+from fcntl import fcntl as _fcntl, F_GETFL as _F_GETFL
+from os import O_NONBLOCK as _O_NONBLOCK
+from errno import EAGAIN as _EAGAIN
+
+
+class Poller(object):
+    """Multiplex any number of event like objects (Inotify, Fanotify, Signalfd,
+    Timer, Eventfd) over a single epoll file descriptor
+
+    >>> poller = Poller()
+    >>> poller.register(inotify)
+    >>> poller.register(timer, edge_triggered=True)
+    >>> for source, events in poller.poll():
+    ...     handle(source, events)
+
+    Level triggered sources (the default) get a single read_events() call per
+    wakeup, any events left in the kernel queue will cause the next poll() to
+    return immediately
+
+    Edge triggered sources are drained until the kernel queue is empty on
+    each wakeup and must be opened in non-blocking mode (eg IN_NONBLOCK,
+    TFD_NONBLOCK) so the final read does not block
+    """
+    def __init__(self, sizehint=-1):
+        """Create a new Poller
+
+        Arguments
+        ----------
+        :param int sizehint: Hint to the kernel on the number of sources expected
+        """
+        self._epoll = _epoll(sizehint)
+        # fd -> (source, edge_triggered)
+        self._sources = {}
+
+    def register(self, source, edge_triggered=False):
+        """Start delivering events from source
+
+        Arguments
+        ----------
+        :param Eventlike source: The object to read events from
+        :param bool edge_triggered: Drain the source completely on each wakeup
+
+        Exceptions
+        -----------
+        :raises ValueError: source is edge triggered but not opened in non-blocking mode
+        :raises ValueError: source is already registered
+        """
+        fd = source.fileno()
+
+        if fd in self._sources:
+            raise ValueError("Source is already registered")
+
+        flags = EPOLLIN
+        if edge_triggered:
+            if not _fcntl(fd, _F_GETFL) & _O_NONBLOCK:
+                raise ValueError("Edge triggered sources must be opened in non-blocking mode")
+            flags |= EPOLLET
+
+        self._epoll.register(fd, flags)
+        self._sources[fd] = (source, edge_triggered)
+
+    def unregister(self, source):
+        """Stop delivering events from source
+
+        Arguments
+        ----------
+        :param Eventlike source: The object previously passed to register
+
+        Exceptions
+        -----------
+        :raises KeyError: source is not registered
+        """
+        for fd, (registered, _) in self._sources.items():
+            if registered is source:
+                break
+        else:
+            raise KeyError("Source is not registered")
+
+        del self._sources[fd]
+        # closing an fd removes it from the epoll set automatically
+        if not source.closed():
+            self._epoll.unregister(fd)
+
+    def poll(self, timeout=None, maxevents=-1):
+        """Wait for one or more sources to become ready and read their events
+
+        Arguments
+        ----------
+        :param float timeout: Seconds to wait for an event, None to wait forever
+        :param int maxevents: Maximum number of sources to read from in one call
+
+        Returns
+        --------
+        :return: (source, events) pairs for every source that had events, empty on timeout
+        :rtype: list
+        """
+        # events already read from the kernel and cached on the object will
+        # not make the fd readable again so check for them first
+        pending = [fd for fd, (source, _) in self._sources.items() if source._events]
+        if pending:
+            timeout = 0
+
+        ready = self._epoll.poll(-1 if timeout is None else timeout, maxevents)
+
+        batches = []
+        for fd in pending:
+            source, _ = self._sources[fd]
+            batches.append((source, source.read_events()))
+
+        for fd, _ in ready:
+            if fd in pending:
+                continue
+
+            source, edge_triggered = self._sources[fd]
+
+            events = self._read_source(source, edge_triggered)
+            if events:
+                batches.append((source, events))
+
+        return batches
+
+    def _read_source(self, source, edge_triggered):
+        events = []
+        try:
+            events.extend(source.read_events())
+            while edge_triggered:
+                events.extend(source.read_events())
+        except OSError as err:
+            # kernel queue is empty (or another reader got there first)
+            if err.errno != _EAGAIN:
+                raise
+
+        return events
+
+    def fileno(self):
+        return self._epoll.fileno()
+
+    def close(self):
+        self._epoll.close()
+        self._sources.clear()
+
+    def closed(self):
+        return self._epoll.closed
+
+    def __len__(self):
+        return len(self._sources)
+
+    def __contains__(self, source):
+        return any(registered is source for registered, _ in self._sources.values())
+
+    def __iter__(self):
+        while True:
+            for batch in self.poll():
+                yield batch
+
+    def __repr__(self):
+        fd = "closed" if self.closed() else self.fileno()
+        return "<{} fd={} sources={}>".format(self.__class__.__name__, fd, len(self))
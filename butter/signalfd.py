@@ -10,7 +10,6 @@ from ._signalfd import signalfd, pthread_sigmask
 from ._signalfd import signum_to_signame
 from ._signalfd_c import ffi as _ffi
 from ._signalfd_c import lib as _lib
-import os as _os
 
 
 class Signalfd(_Eventlike):
@@ -83,10 +82,10 @@ class Signalfd(_Eventlike):
         self._update()
         
     def _read_events(self):
-        buf = _os.read(self.fileno(), _SIGINFO_LENGTH)
+        self._read_into_buffer(_SIGINFO_LENGTH)
         siginfo = _ffi.new('struct signalfd_siginfo *')
 
-        _ffi.buffer(siginfo)[0:_SIGINFO_LENGTH] = buf
+        _ffi.memmove(siginfo, self._buffer, _SIGINFO_LENGTH)
         
         return [Signal(siginfo)]
 
@@ -12,7 +12,9 @@ from ._timerfd import CLOCK_REALTIME, CLOCK_REALTIME_COARSE
 from ._timerfd import CLOCK_REALTIME_ALARM, CLOCK_BOOTTIME_ALARM
 
 from ._timerfd import ffi as _ffi
-import os as _os
+import struct as _struct
+
+_expirations = _struct.Struct('Q')
 
 
 class Timer(_Eventlike, TimerVal):
@@ -91,13 +93,10 @@ class Timer(_Eventlike, TimerVal):
         return old_timer
     
     def _read_events(self):
-        data = _os.read(self.fileno(), 8)
-        value = _ffi.new('uint64_t[1]')
-        _ffi.buffer(value, 8)[0:8] = data
+        self._read_into_buffer(8)
+        value, = _expirations.unpack_from(self._buffer)
 
-        return [value[0]] # value's container is not a list
-                          # lets make it one to expose a fammliar
-                          # interface
+        return [value] # expose a fammliar (list) interface
     def __repr__(self):
             fd = "closed" if self.closed() else self.fileno()
             return "<{} fd={} offset=({}s, {}ns) reoccuring=({}s, {}ns)>".format(self.__class__.__name__,
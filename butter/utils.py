@@ -23,6 +23,17 @@ if platform.python_version_tuple() < ('3', '0', '0'):
 else:
     CLOEXEC_DEFAULT = False
 
+try:
+    from os import readv as _readv
+except ImportError:
+    # python < 3.3 has no readv, emulate it with a read and a copy
+    from os import read as _read
+    def _readv(fd, buffers):
+        buf = buffers[0]
+        data = _read(fd, len(buf))
+        buf[0:len(data)] = data
+        return len(data)
+
 PermissionError = PermissionError
 TimeoutError = TimeoutError
 
@@ -47,17 +58,45 @@ def get_buffered_length(fd):
 
 class Eventlike(object):
     _fd = None
+    _buffer = None
+    _buffer_iov = None
     def __init__(self, *args, **kwargs):
         """*** This is a cooprative superclass, ensure you use super in the subclass's __init__ ***
         eg: super(SubClass, self).__init__(*args, **kwargs)
         """
-        self._events = []
+        self._events = deque()
         super(Eventlike, self).__init__()
     
     def close(self):
         _close(self.fileno())
         self._fd = None
 
+    def _read_into_buffer(self, size):
+        """Read up to size bytes from the fd into a buffer owned by this instance
+
+        The buffer is allocated on first use and reused for every read after
+        that, it is only replaced when a larger read is requested. This means
+        the data is only valid until the next call
+
+        Arguments
+        ----------
+        :param int size: The maximum amount of bytes to read
+
+        Returns
+        --------
+        :return: The amount of bytes read into self._buffer
+        :rtype: int
+        """
+        iov = self._buffer_iov
+        if iov is None or len(iov[0]) != size:
+            if self._buffer is None or len(self._buffer) < size:
+                # allocate a new buffer rather than resizing the old one as
+                # resizing a bytearray with a view exported is not allowed
+                self._buffer = bytearray(size)
+            self._buffer_iov = iov = [memoryview(self._buffer)[:size]]
+
+        return _readv(self.fileno(), iov)
+
     def fileno(self):
         if self._fd:
             return self._fd
@@ -106,7 +145,7 @@ class Eventlike(object):
 
     def truncate(self):
         """Discard all events in the queue"""
-        self._events = []
+        self._events.clear()
 
     def write(self):
         raise NotImplementedError
@@ -146,22 +185,21 @@ class Eventlike(object):
     def read_event(self):
         """Return a single event, may read more than one event from the kernel and cache the values
         """
-        try:
-            event = self._events.pop(0)
-        except IndexError:
-            events = self._read_events()
-            event = events.pop(0)
-            self._events = events
+        events = self._events
+        if not events:
+            events.extend(self._read_events())
 
-        return event
+        # raises IndexError if the read returned no events
+        return events.popleft()
 
     def read_events(self):
         """Read and return multiple events from the kernel
         """
         events = self._events
-        self._events = []
         if len(events) > 0:
-            return events
+            pending = list(events)
+            events.clear()
+            return pending
         else:
             return self._read_events()
 
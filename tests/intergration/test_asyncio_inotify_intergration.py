@@ -0,0 +1,47 @@
+from butter.asyncio.inotify import Inotify_async
+from butter.inotify import IN_CREATE
+
+from tempfile import TemporaryDirectory
+import asyncio
+import os
+
+import pytest
+
+
+@pytest.mark.intergration
+@pytest.mark.inotify
+@pytest.mark.asyncio
+def test_asyncio_inotify_batches_intergration():
+    async def run(tmpdir):
+        loop = asyncio.get_event_loop()
+        watcher = Inotify_async(loop=loop, maxsize=2, low_water=0)
+        watcher.watch(tmpdir, IN_CREATE)
+
+        with pytest.raises(asyncio.QueueEmpty):
+            watcher.get_batch_nowait()
+
+        for name in ('a', 'b', 'c'):
+            open(os.path.join(tmpdir, name), 'w').close()
+
+        # all 3 events arrive in a single read and reading is paused
+        batch = await watcher.get_batch()
+        assert [event.filename for event in batch] == [b'a', b'b', b'c']
+        assert watcher.pauses == 1
+        # drained below low_water so reading has resumed
+        assert not watcher.paused
+        assert watcher.overflows == 0
+
+        open(os.path.join(tmpdir, 'd'), 'w').close()
+        open(os.path.join(tmpdir, 'e'), 'w').close()
+        event = await watcher.get_event()
+        assert event.filename == b'd'
+        assert watcher.qsize() == 1
+
+        names = []
+        loop.call_soon(watcher.close)
+        async for batch in watcher.batches():
+            names.extend(event.filename for event in batch)
+        assert names == [b'e']
+
+    with TemporaryDirectory() as tmpdir:
+        asyncio.run(run(tmpdir))
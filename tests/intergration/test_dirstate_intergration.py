@@ -0,0 +1,59 @@
+from butter.dirstate import DirectoryState
+
+from tempfile import TemporaryDirectory
+import shutil
+import os
+
+import pytest
+
+
+@pytest.mark.intergration
+@pytest.mark.inotify
+def test_dirstate_intergration():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = os.fsencode(tmpdir)
+        src = os.path.join(tmpdir, b'src')
+        os.makedirs(os.path.join(tmpdir, b'.git'))
+        os.mkdir(src)
+        with open(os.path.join(src, b'a.py'), 'w') as f:
+            f.write('a')
+
+        state = DirectoryState(tmpdir, exclude=['.git/'], max_tombstones=3)
+
+        delta = state.changes_since(0)
+        assert not delta.reset
+        assert sorted(change.path for change in delta.changes) == [src, os.path.join(src, b'a.py')]
+        assert state.get(os.path.join(src, b'a.py')).size == 1
+
+        # nothing changed, nothing reported
+        assert state.changes_since(delta.seq).changes == []
+
+        with open(os.path.join(src, b'a.py'), 'a') as f:
+            f.write('bc')
+        open(os.path.join(src, b'b.py'), 'w').close()
+        open(os.path.join(tmpdir, b'.git', b'HEAD'), 'w').close()
+
+        new = state.changes_since(delta.seq)
+        assert [(change.path, change.size) for change in new.changes] == \
+               [(os.path.join(src, b'a.py'), 3), (os.path.join(src, b'b.py'), 0)]
+
+        # moving a directory out tombstones everything below it
+        shutil.move(src, os.path.join(os.fsencode(os.path.dirname(tmpdir)), os.path.basename(tmpdir) + b'-moved'))
+        try:
+            moved = state.changes_since(new.seq)
+            assert sorted(change.path for change in moved.changes if change.deleted) == \
+                   [src, os.path.join(src, b'a.py'), os.path.join(src, b'b.py')]
+            assert len(state) == 0
+            assert not moved.reset
+
+            # only 3 tombstones are kept so older seqs have to reset
+            open(os.path.join(tmpdir, b'c.py'), 'w').close()
+            state.update()
+            os.unlink(os.path.join(tmpdir, b'c.py'))
+            assert not state.changes_since(moved.seq).reset
+            assert state.horizon > new.seq
+            assert state.changes_since(new.seq).reset
+        finally:
+            shutil.rmtree(os.path.join(os.fsencode(os.path.dirname(tmpdir)), os.path.basename(tmpdir) + b'-moved'))
+
+        state.close()
@@ -0,0 +1,139 @@
+from butter.fanotify import Fanotify, FAN_CLASS_CONTENT, FAN_OPEN_PERM, FAN_EVENT_ON_CHILD
+from butter.fanotify import FAN_ALLOW, FAN_DENY, FAN_CLOSE_WRITE, PermissionServer
+from butter.fanotify import FAN_CLASS_NOTIF, FAN_NONBLOCK, FAN_REPORT_DFID_NAME, FAN_CREATE, FAN_ONDIR
+
+from tempfile import TemporaryDirectory
+from subprocess import Popen, PIPE
+from threading import Event
+import os
+
+import pytest
+
+
+@pytest.mark.intergration
+@pytest.mark.fanotify
+@pytest.mark.skipif(os.getuid() != 0, reason="fanotify can only be used by root")
+def test_fanotify_respond_intergration():
+    with TemporaryDirectory() as tmpdir:
+        names = ['allowed', 'denied', 'other']
+        for name in names:
+            open(os.path.join(tmpdir, name), 'w').close()
+
+        notifier = Fanotify(FAN_CLASS_CONTENT)
+        notifier.watch(tmpdir, FAN_OPEN_PERM|FAN_EVENT_ON_CHILD)
+
+        procs = dict((name, Popen(['cat', os.path.join(tmpdir, name)], stderr=PIPE)) for name in names)
+
+        events = []
+        while len(events) < len(names):
+            events.extend(notifier.read_events())
+
+        verdicts = [FAN_DENY if event.filename.endswith('denied') else FAN_ALLOW for event in events]
+        assert notifier.respond(events, verdicts) == len(names)
+        assert all(event.fd is None for event in events)
+
+        for name, proc in procs.items():
+            proc.communicate()
+            assert (proc.returncode != 0) == (name == 'denied')
+
+        notifier.close()
+
+
+@pytest.mark.intergration
+@pytest.mark.fanotify
+@pytest.mark.skipif(os.getuid() != 0, reason="fanotify can only be used by root")
+def test_permission_server_intergration():
+    with TemporaryDirectory() as tmpdir:
+        names = ['fast', 'slow', 'broken']
+        for name in names:
+            open(os.path.join(tmpdir, name), 'w').close()
+
+        release = Event()
+        def decide(event):
+            name = os.path.basename(event.filename)
+            if name == 'slow':
+                release.wait(5)
+            elif name == 'broken':
+                raise RuntimeError(name)
+            return FAN_ALLOW
+
+        server = PermissionServer(decide, workers=2, timeout=0.2, default=FAN_DENY)
+        server.watch(tmpdir, FAN_OPEN_PERM|FAN_EVENT_ON_CHILD)
+        server.start()
+
+        procs = dict((name, Popen(['cat', os.path.join(tmpdir, name)], stderr=PIPE)) for name in names)
+        for proc in procs.values():
+            proc.communicate(timeout=5)
+
+        # the slow decision timed out rather than holding up the others
+        assert procs['fast'].returncode == 0
+        assert procs['slow'].returncode != 0
+        assert procs['broken'].returncode != 0
+
+        stats = server.stats()
+        assert (stats.answered, stats.timeouts, stats.errors) == (3, 1, 1)
+        assert sum(stats.latency.values()) == 3
+
+        release.set()
+        server.close()
+
+
+@pytest.mark.intergration
+@pytest.mark.fanotify
+@pytest.mark.skipif(os.getuid() != 0, reason="fanotify can only be used by root")
+def test_permission_server_verdict_cache_intergration():
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'file')
+        open(path, 'w').close()
+
+        decided = []
+        def decide(event):
+            decided.append(event.filename)
+            return FAN_ALLOW
+
+        server = PermissionServer(decide, workers=2, verdict_cache=16)
+        server.watch(tmpdir, FAN_OPEN_PERM|FAN_CLOSE_WRITE|FAN_EVENT_ON_CHILD)
+        server.start()
+
+        def cat():
+            proc = Popen(['cat', path], stderr=PIPE)
+            proc.communicate(timeout=5)
+            return proc.returncode
+
+        assert cat() == 0
+        assert cat() == 0
+        assert decided == [path]
+
+        # written to (the open is answered from the cache), decided again
+        with open(path, 'w') as f:
+            f.write('changed')
+        assert cat() == 0
+        assert decided == [path, path]
+        assert server.stats().cached == 2
+
+        server.close()
+
+
+@pytest.mark.intergration
+@pytest.mark.fanotify
+@pytest.mark.skipif(os.getuid() != 0, reason="fanotify can only be used by root")
+def test_fanotify_fid_intergration():
+    with TemporaryDirectory() as tmpdir:
+        try:
+            notifier = Fanotify(FAN_CLASS_NOTIF|FAN_NONBLOCK|FAN_REPORT_DFID_NAME)
+        except ValueError:
+            pytest.skip("kernel does not support FAN_REPORT_DFID_NAME")
+        notifier.watch(tmpdir, FAN_CREATE|FAN_ONDIR|FAN_EVENT_ON_CHILD)
+
+        open(os.path.join(tmpdir, 'file'), 'w').close()
+        os.mkdir(os.path.join(tmpdir, 'dir'))
+
+        events = notifier.read_events()
+        assert [event.name for event in events] == ['file', 'dir']
+        assert all(event.fd < 0 for event in events)
+        assert events[0].dir_handle == events[1].dir_handle
+
+        # resolved through the fd kept open on the mount
+        assert [event.filename for event in events] == [os.path.join(tmpdir, 'file'), os.path.join(tmpdir, 'dir')]
+
+        notifier.close()
@@ -0,0 +1,238 @@
+from butter.inotify import Inotify, RecursiveInotify, ShardedInotify, IN_NONBLOCK
+from butter.inotify import IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO, IN_ISDIR
+from butter.inotify import IN_OPEN, IN_CLOSE_WRITE, IN_Q_OVERFLOW
+
+from tempfile import TemporaryDirectory
+import shutil
+import os
+
+import pytest
+
+
+def drain(notifier):
+    events = []
+    while True:
+        try:
+            events.extend(notifier.read_events())
+        except BlockingIOError:
+            return events
+
+
+@pytest.mark.intergration
+@pytest.mark.inotify
+def test_recursive_inotify_intergration():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = os.fsencode(tmpdir)
+        os.makedirs(os.path.join(tmpdir, b'a', b'b'))
+
+        notifier = RecursiveInotify(IN_CREATE|IN_DELETE|IN_MOVED_FROM|IN_MOVED_TO, IN_NONBLOCK)
+        reports = []
+        root_wd = notifier.watch(tmpdir, workers=2, progress=reports.append)
+        assert notifier.watch_count == 3
+        assert notifier.last_crawl.directories == 3
+        assert reports[-1] == notifier.last_crawl and reports[-1].done
+        assert notifier.get_path(root_wd) == tmpdir
+
+        # new subtree is attached and its contents reported
+        new_dir = os.path.join(tmpdir, b'a', b'new', b'sub')
+        os.makedirs(new_dir)
+        open(os.path.join(new_dir, b'file'), 'w').close()
+
+        paths = set(event.path for event in drain(notifier))
+        assert os.path.join(tmpdir, b'a', b'new') in paths
+        assert os.path.join(new_dir, b'file') in paths
+        assert notifier.get_wd(new_dir) is not None
+
+        # moved subtree is re-indexed under its new path
+        moved_dir = os.path.join(tmpdir, b'moved')
+        os.rename(os.path.join(tmpdir, b'a', b'new'), moved_dir)
+        drain(notifier)
+        assert notifier.get_wd(new_dir) is None
+        assert notifier.get_wd(os.path.join(moved_dir, b'sub')) is not None
+
+        # deleted subtree is dropped
+        shutil.rmtree(os.path.join(tmpdir, b'a'))
+        shutil.rmtree(moved_dir)
+        drain(notifier)
+        assert notifier.watch_count == 1
+
+        notifier.close()
+
+
+@pytest.mark.intergration
+@pytest.mark.inotify
+def test_recursive_inotify_overflow_intergration():
+    with open('/proc/sys/fs/inotify/max_queued_events') as f:
+        max_queued_events = int(f.read())
+    if max_queued_events > 100000:
+        pytest.skip("max_queued_events is too large to overflow quickly")
+
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = os.fsencode(tmpdir)
+        noisy = os.path.join(tmpdir, b'noisy')
+        late = os.path.join(tmpdir, b'late')
+
+        notifier = RecursiveInotify(IN_CREATE|IN_DELETE|IN_OPEN|IN_CLOSE_WRITE, IN_NONBLOCK, snapshot=True)
+        notifier.watch(tmpdir)
+
+        # each open/close pair queues 2 events that the kernel can not merge
+        for i in range(max_queued_events // 2 + 1):
+            open(noisy, 'w').close()
+        # lost in the overflow, should be picked up by the rescan
+        open(late, 'w').close()
+
+        events = drain(notifier)
+        assert notifier.overflows == 1
+        assert any(event.mask & IN_Q_OVERFLOW for event in events)
+        assert any(event.path == late and event.create_event for event in events)
+
+        notifier.close()
+
+
+@pytest.mark.intergration
+@pytest.mark.inotify
+def test_recursive_inotify_budget_intergration():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = os.fsencode(tmpdir)
+        for name in (b'a', b'b', b'c'):
+            os.makedirs(os.path.join(tmpdir, name, b'sub'))
+
+        notifier = RecursiveInotify(IN_CREATE|IN_DELETE, IN_NONBLOCK, max_watches=4, poll_interval=0)
+        notifier.watch(tmpdir, workers=1)
+
+        # the crawl stops at the budget and polls the rest
+        assert notifier.watch_count == 4
+        assert notifier.polled
+
+        # a new directory evicts a cold subtree rather than failing
+        new_dir = os.path.join(tmpdir, b'new')
+        os.mkdir(new_dir)
+        drain(notifier)
+        assert notifier.get_wd(new_dir) is not None
+        assert notifier.watch_count == 4
+        assert notifier.evictions >= 1
+
+        # changes in polled subtrees are still reported
+        polled = notifier.polled[0]
+        created = os.path.join(polled, b'file')
+        open(created, 'w').close()
+        events = notifier.poll_evicted()
+        assert [(event.path, event.create_event) for event in events] == [(created, True)]
+
+        notifier.close()
+
+
+@pytest.mark.intergration
+@pytest.mark.inotify
+def test_inotify_stats_intergration():
+    with TemporaryDirectory() as tmpdir:
+        samples = []
+        notifier = Inotify(IN_NONBLOCK, stats_hook=samples.append)
+        wd = notifier.watch(tmpdir, IN_CREATE|IN_CLOSE_WRITE)
+
+        for name in ('a', 'b', 'c'):
+            open(os.path.join(tmpdir, name), 'w').close()
+        drain(notifier)
+
+        stats = notifier.stats()
+        assert stats.events == 6
+        assert stats.by_wd == {wd: 6}
+        assert stats.by_event == {'IN_CREATE': 3, 'IN_CLOSE_WRITE': 3}
+        assert stats.bytes == sum(sample.bytes for sample in samples)
+        assert stats.reads == len(samples) == sum(stats.batch_sizes.values())
+        assert stats.overflows == 0
+
+        notifier.close()
+
+        assert Inotify().stats() is None
+
+
+@pytest.mark.intergration
+@pytest.mark.inotify
+def test_sharded_inotify_intergration():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = os.fsencode(tmpdir)
+        names = [b'dir' + str(i).encode() for i in range(8)]
+        for name in names:
+            os.makedirs(os.path.join(tmpdir, name, b'sub'))
+
+        sharded = ShardedInotify(3, IN_CREATE|IN_DELETE)
+        sharded.watch(tmpdir)
+
+        # every subtree is watched by exactly one shard, the root by all of them
+        for name in names:
+            for sub in (os.path.join(tmpdir, name), os.path.join(tmpdir, name, b'sub')):
+                owners = [shard for shard in sharded.shards if shard.get_wd(sub) is not None]
+                assert owners == [sharded.shard_for(os.path.join(tmpdir, name))]
+        assert sharded.watch_count == len(names) * 2 + 3
+
+        sharded.start()
+        expected = []
+        for name in names:
+            path = os.path.join(tmpdir, name, b'sub', b'file')
+            open(path, 'w').close()
+            os.unlink(path)
+            expected.append((path, IN_CREATE))
+            expected.append((path, IN_DELETE))
+
+        seen = []
+        while len(seen) < len(expected):
+            batch = sharded.read_events(timeout=5)
+            assert batch, "timed out waiting for events"
+            seen.extend((event.path, event.mask) for event in batch)
+
+        # merged across shards but in order for each path
+        assert sorted(seen) == sorted(expected)
+        for name in names:
+            path = os.path.join(tmpdir, name, b'sub', b'file')
+            assert [mask for event_path, mask in seen if event_path == path] == [IN_CREATE, IN_DELETE]
+
+        sharded.close()
+
+
+@pytest.mark.intergration
+@pytest.mark.inotify
+def test_recursive_inotify_checkpoint_intergration():
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = os.fsencode(tmpdir)
+        root = os.path.join(tmpdir, b'tree')
+        checkpoint = os.path.join(tmpdir, b'checkpoint')
+        for name in (b'a', b'b', b'c'):
+            os.makedirs(os.path.join(root, name, b'sub'))
+            open(os.path.join(root, name, b'file'), 'w').close()
+        # directories modified just before a save are always rescanned
+        for dirpath, _, _ in os.walk(root):
+            os.utime(dirpath, ns=(10**18, 10**18))
+
+        notifier = RecursiveInotify(IN_CREATE|IN_DELETE, IN_NONBLOCK, snapshot=True)
+        notifier.watch(root, workers=1)
+        assert notifier.save_checkpoint(checkpoint) == 7
+        notifier.close()
+
+        # changed while nothing was watching
+        os.unlink(os.path.join(root, b'a', b'file'))
+        os.makedirs(os.path.join(root, b'c', b'new', b'deep'))
+
+        notifier = RecursiveInotify(IN_CREATE|IN_DELETE, IN_NONBLOCK, snapshot=True)
+        notifier.watch(root, workers=1, checkpoint=checkpoint)
+
+        # only the directories that changed were listed, the new subtree was crawled
+        assert notifier.last_restore.directories == 7
+        assert notifier.last_restore.rescanned == 2
+        assert notifier.watch_count == 9
+        assert notifier.get_entry(os.path.join(root, b'b', b'file')) is not None
+
+        events = [(event.path, event.mask) for event in drain(notifier)]
+        assert sorted(events) == [(os.path.join(root, b'a', b'file'), IN_DELETE),
+                                  (os.path.join(root, b'c', b'new'), IN_CREATE|IN_ISDIR),
+                                  (os.path.join(root, b'c', b'new', b'deep'), IN_CREATE|IN_ISDIR)]
+        notifier.close()
+
+        # an unusable checkpoint falls back to a crawl
+        with open(checkpoint, 'wb') as f:
+            f.write(b'junk')
+        notifier = RecursiveInotify(IN_CREATE|IN_DELETE, IN_NONBLOCK, snapshot=True)
+        notifier.watch(root, workers=1, checkpoint=checkpoint)
+        assert notifier.last_restore is None
+        assert notifier.watch_count == 9
+        notifier.close()
@@ -0,0 +1,46 @@
+from butter.eventfd import Eventfd
+from butter.inotify import Inotify, IN_ALL_EVENTS, IN_NONBLOCK
+from butter.poller import Poller
+
+from tempfile import TemporaryDirectory
+import os
+
+import pytest
+
+
+@pytest.mark.intergration
+@pytest.mark.poller
+def test_poller_intergration():
+    with TemporaryDirectory() as tmpdir:
+        poller = Poller()
+        ev = Eventfd()
+        notifier = Inotify(IN_NONBLOCK)
+        notifier.watch(tmpdir, IN_ALL_EVENTS)
+
+        poller.register(ev)
+        poller.register(notifier, edge_triggered=True)
+        assert len(poller) == 2
+        assert ev in poller
+
+        assert poller.poll(0) == [], "No sources should be ready yet"
+
+        ev.increment(3)
+        open(os.path.join(tmpdir, 'test'), 'w').close()
+
+        batches = dict(poller.poll(1))
+        assert batches[ev] == [3]
+        assert [event.filename for event in batches[notifier]] == [b'test'] * 3
+        assert poller.poll(0) == [], "Edge triggered source should have been drained"
+
+        poller.unregister(ev)
+        ev.increment(1)
+        assert poller.poll(0) == []
+
+        blocking = Eventfd()
+        with pytest.raises(ValueError):
+            poller.register(blocking, edge_triggered=True)
+        blocking.close()
+
+        poller.close()
+        notifier.close()
+        ev.close()
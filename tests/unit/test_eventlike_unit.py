@@ -4,6 +4,7 @@ from butter.inotify import Inotify
 from butter.signalfd import Signalfd
 from butter.timerfd import Timer
 import pytest
+from butter.utils import Eventlike
 import os
 
 @pytest.fixture(params=[Eventfd, Fanotify, Inotify, Signalfd, Timer])
@@ -27,3 +28,26 @@ def test_fd_closed(obj):
 
 
     os.close = old_close
+
+class BatchEventlike(Eventlike):
+    def __init__(self, batches):
+        super(BatchEventlike, self).__init__()
+        self._batches = batches
+
+    def _read_events(self):
+        return self._batches.pop(0)
+
+@pytest.mark.eventlike
+@pytest.mark.unit
+def test_event_queue_order():
+    """Events read as a batch are returned one at a time in order"""
+    obj = BatchEventlike([[1, 2, 3], [4, 5], [6, 7], [8], []])
+
+    assert obj.read_event() == 1
+    assert obj.read_events() == [2, 3], "Cached events should be returned before reading more"
+    assert obj.read_events() == [4, 5]
+    assert obj.read_event() == 6
+    obj.truncate()
+    assert obj.read_events() == [8], "truncate should discard cached events"
+    with pytest.raises(IndexError):
+        obj.read_event()
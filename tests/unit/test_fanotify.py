@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+from butter.fanotify import PathCache, VerdictCache, FAN_ALLOW, FAN_DENY
+from butter.fanotify import FanotifyFidEvent, FAN_CREATE, FAN_NOFD, FAN_EVENT_INFO_TYPE_DFID_NAME
+from butter.fanotify import str_to_events
+from butter.fhandle import FileHandle
+
+from tempfile import TemporaryDirectory
+import struct
+import os
+
+import pytest
+
+
+@pytest.mark.unit
+@pytest.mark.fanotify
+def test_path_cache():
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'file')
+        open(path, 'w').close()
+
+        cache = PathCache(maxsize=1)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            assert cache(fd) == path
+            assert cache(fd) == path
+            assert (cache.hits, cache.misses) == (1, 1)
+
+            # a rename bumps the ctime so the new name is picked up
+            renamed = os.path.join(tmpdir, 'renamed')
+            os.rename(path, renamed)
+            assert cache(fd) == renamed
+            assert cache.misses == 2
+
+            cache.invalidate(fd)
+            assert len(cache) == 0
+            assert cache(fd) == renamed
+
+            # bounded, the least recently used path is forgotten
+            other = os.open(tmpdir, os.O_RDONLY)
+            try:
+                assert cache(other) == tmpdir
+                assert len(cache) == 1
+                assert cache(fd) == renamed
+                assert cache.misses == 5
+            finally:
+                os.close(other)
+        finally:
+            os.close(fd)
+
+
+@pytest.mark.unit
+@pytest.mark.fanotify
+def test_verdict_cache():
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'file')
+        with open(path, 'w') as f:
+            f.write('clean')
+
+        cache = VerdictCache()
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            ticket, verdict = cache.lookup(fd)
+            assert verdict is None
+            cache.store(ticket, FAN_ALLOW)
+            assert cache.lookup(fd) == (None, FAN_ALLOW)
+
+            # a different size or mtime is a miss
+            with open(path, 'a') as f:
+                f.write('infected')
+            ticket, verdict = cache.lookup(fd)
+            assert verdict is None
+
+            # invalidated while being decided, the verdict is not kept
+            cache.invalidate(fd)
+            cache.store(ticket, FAN_DENY)
+            ticket, verdict = cache.lookup(fd)
+            assert verdict is None
+            cache.store(ticket, FAN_DENY)
+            assert cache.lookup(fd) == (None, FAN_DENY)
+            assert (cache.hits, cache.misses) == (2, 3)
+        finally:
+            os.close(fd)
+
+
+@pytest.mark.unit
+@pytest.mark.fanotify
+def test_str_to_events_fid():
+    handle = b'\x01\x02\x03\x04\x05\x06\x07\x08'
+    record = struct.pack('iiIi', 7, 9, len(handle), 1) + handle + b'new_file\0'
+    record += b'\0' * (-(len(record) + 4) % 4)
+    record = struct.pack('BBH', FAN_EVENT_INFO_TYPE_DFID_NAME, 0, len(record) + 4) + record
+    metadata = struct.Struct('IBBHQii')
+    buf = metadata.pack(metadata.size + len(record), 3, 0, metadata.size, FAN_CREATE, FAN_NOFD, 42) + record
+
+    resolved = []
+    def resolver(fsid, dir_handle, name):
+        resolved.append((fsid, dir_handle, name))
+        return '/dir/' + name
+
+    events = str_to_events(buf + buf, resolver=resolver)
+    assert len(events) == 2
+
+    event = events[0]
+    assert isinstance(event, FanotifyFidEvent)
+    assert (event.mask, event.fd, event.pid) == (FAN_CREATE, FAN_NOFD, 42)
+    assert event.fsid == (7, 9)
+    assert event.dir_handle == FileHandle(1, handle)
+    assert event.handle is None
+    assert event.name == 'new_file'
+
+    # only resolved when asked for, and only once
+    assert resolved == []
+    assert event.filename == '/dir/new_file'
+    assert event.filename == '/dir/new_file'
+    assert resolved == [((7, 9), FileHandle(1, handle), 'new_file')]
@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 
 import pytest
-from butter.inotify import watch
+from butter.inotify import watch, str_to_events, str_to_batch, str_to_lazy_events, InotifyBatch
+from butter.inotify import InotifyEvent, MovePairer, Rename, Coalescer, PathFilter
+from butter.inotify import IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVED_FROM, IN_MOVED_TO
+from butter.inotify import IN_OPEN, IN_MODIFY, IN_CLOSE_WRITE, IN_ATTRIB, IN_ISDIR
 
 from subprocess import Popen
 from tempfile import TemporaryDirectory
 from time import sleep
+import struct
 import os
 
 def test_watch():
@@ -18,3 +22,125 @@ def test_watch():
         event = watch(tmp_dir)
         
         proc.wait()
+
+def make_raw_event(wd, mask, cookie, name=b''):
+    name_len = (len(name) + 16) & ~15 if name else 0
+    return struct.pack('iIII', wd, mask, cookie, name_len) + name.ljust(name_len, b'\0')
+
+@pytest.mark.unit
+@pytest.mark.inotify
+def test_str_to_events():
+    raw = make_raw_event(1, IN_CREATE, 0, b'new_file') + \
+          make_raw_event(2, IN_DELETE_SELF, 0) + \
+          make_raw_event(1, IN_MOVED_FROM, 42, b'a' * 16)
+
+    events = str_to_events(raw)
+
+    assert events == [(1, IN_CREATE, 0, b'new_file'),
+                      (2, IN_DELETE_SELF, 0, b''),
+                      (1, IN_MOVED_FROM, 42, b'a' * 16)]
+    assert events[0].create_event
+    assert str_to_events(bytearray(raw)) == events, "Parser should accept any buffer"
+    assert str_to_events(b'') == []
+
+class FakeInotify(object):
+    _events = ()
+
+@pytest.mark.unit
+@pytest.mark.inotify
+def test_move_pairer():
+    pairer = MovePairer(FakeInotify(), window=60)
+    moved_from = InotifyEvent(1, IN_MOVED_FROM, 7, b'old')
+    moved_to = InotifyEvent(2, IN_MOVED_TO, 7, b'new')
+    other = InotifyEvent(1, IN_CREATE, 0, b'other')
+
+    # split across two batches
+    assert pairer.process([moved_from, other]) == [other]
+    assert pairer.process([moved_to]) == [Rename(moved_from, moved_to)]
+    assert pairer.renames == 1
+
+    # partners that never turn up become a delete and a create
+    pairer.process([InotifyEvent(1, IN_MOVED_FROM, 8, b'gone')])
+    assert pairer.flush(all=True) == [(1, IN_DELETE, 0, b'gone')]
+    assert pairer.process([InotifyEvent(1, IN_MOVED_TO, 9, b'came')]) == [(1, IN_CREATE, 0, b'came')]
+    assert pairer.unmatched == 2
+
+@pytest.mark.unit
+@pytest.mark.inotify
+def test_coalescer():
+    coalescer = Coalescer(FakeInotify())
+    events = [InotifyEvent(1, IN_OPEN, 0, b'a'),
+              InotifyEvent(1, IN_MODIFY, 0, b'a'),
+              InotifyEvent(1, IN_MODIFY, 0, b'b'),
+              InotifyEvent(1, IN_CLOSE_WRITE, 0, b'a'),
+              InotifyEvent(1, IN_DELETE, 0, b'a'),
+              InotifyEvent(1, IN_MODIFY, 0, b'a'),
+              InotifyEvent(1, IN_ATTRIB, 0, b'b')]
+
+    assert coalescer.process(events) == [(1, IN_OPEN|IN_MODIFY|IN_CLOSE_WRITE, 0, b'a'),
+                                         (1, IN_MODIFY|IN_ATTRIB, 0, b'b'),
+                                         (1, IN_DELETE, 0, b'a'),
+                                         (1, IN_MODIFY, 0, b'a')]
+    assert coalescer.merged == 3
+
+@pytest.mark.unit
+@pytest.mark.inotify
+def test_str_to_batch():
+    raw = make_raw_event(1, IN_CREATE, 0, b'new_file') + \
+          make_raw_event(2, IN_CLOSE_WRITE, 0) + \
+          make_raw_event(1, IN_CLOSE_WRITE, 0, b'b' * 16)
+
+    batch = str_to_batch(bytearray(raw) + bytearray(64), len(raw))
+
+    assert len(batch) == 3
+    assert list(batch.wd) == [1, 2, 1]
+    assert batch.indices(IN_CLOSE_WRITE) == [1, 2]
+    assert batch.count(IN_CLOSE_WRITE|IN_CREATE) == 3
+    assert batch.filename(0) == b'new_file'
+    assert batch.events() == str_to_events(raw)
+    assert list(InotifyBatch.from_events(batch)) == list(batch)
+
+@pytest.mark.unit
+@pytest.mark.inotify
+def test_path_filter():
+    path_filter = PathFilter(include=['*.py', '*.so'], exclude=['.git/', '__pycache__/', '*_tmp.py'])
+
+    assert path_filter(b'setup.py')
+    assert path_filter(b'_lib.so')
+    assert not path_filter(b'README')
+    assert not path_filter(b'test_tmp.py')
+    # include patterns never apply to directories
+    assert path_filter(b'src', is_dir=True)
+    assert not path_filter(b'.git', is_dir=True)
+    assert not path_filter(b'__pycache__', is_dir=True)
+    # trailing slash patterns only match directories
+    assert not PathFilter(exclude=['.git/'])(b'.git', is_dir=True)
+    assert PathFilter(exclude=['.git/'])(b'.git')
+
+    raw = make_raw_event(1, IN_CREATE, 0, b'a.py') + \
+          make_raw_event(1, IN_CREATE, 0, b'a.txt') + \
+          make_raw_event(1, IN_CREATE | IN_ISDIR, 0, b'.git') + \
+          make_raw_event(1, IN_CREATE | IN_ISDIR, 0, b'pkg') + \
+          make_raw_event(1, IN_DELETE_SELF, 0)
+
+    events = str_to_events(raw, event_filter=path_filter.event_filter)
+
+    assert [event.filename for event in events] == [b'a.py', b'pkg', b'']
+
+@pytest.mark.unit
+@pytest.mark.inotify
+def test_str_to_lazy_events():
+    raw = make_raw_event(1, IN_CREATE, 0, b'new_file') + \
+          make_raw_event(2, IN_DELETE_SELF, 0) + \
+          make_raw_event(1, IN_MOVED_FROM, 42, b'a' * 16)
+
+    events = str_to_lazy_events(bytearray(raw), len(raw))
+
+    assert events == str_to_events(raw)
+    assert [event.mask for event in events] == [IN_CREATE, IN_DELETE_SELF, IN_MOVED_FROM]
+    assert events[0].create_event
+    assert events[2].filename == b'a' * 16
+    assert events[1].filename == b''
+    wd, mask, cookie, filename = events[0]
+    assert filename == b'new_file'
+    assert events[2]._replace(mask=IN_DELETE) == InotifyEvent(1, IN_DELETE, 42, b'a' * 16)